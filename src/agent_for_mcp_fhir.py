@@ -1,13 +1,21 @@
 import asyncio
+import hashlib
+import logging
 import os
+import queue
 import sys
-from contextlib import asynccontextmanager
+
+import orjson
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from operator import attrgetter
 from typing import Annotated, Literal, List, Dict, Any, Optional
 from typing_extensions import TypedDict
 
 # LangChain / LangGraph Imports
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, ToolMessage, BaseMessage, SystemMessage
+from langchain_core.messages import HumanMessage, ToolMessage, BaseMessage, SystemMessage, RemoveMessage
 from langgraph.graph import StateGraph, START
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
@@ -20,23 +28,81 @@ from dotenv import load_dotenv
 # 1. Load Environment Variables
 load_dotenv()
 
+# =============================================================================
+# 0. Logging Setup (비동기 안전)
+# =============================================================================
+# print()는 stdout이 파이프(uvicorn/Docker)일 때 블로킹되어 이벤트 루프를 세울 수 있음.
+# QueueHandler로 로그 레코드만 큐에 넣고, 포맷팅/쓰기는 리스너 스레드에서 수행
+logger = logging.getLogger("mcp_agent")
+if not logger.handlers:
+    _log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(_log_queue))
+    logger.setLevel(os.getenv("MCP_AGENT_LOG_LEVEL", "INFO").upper())
+    _log_listener = QueueListener(_log_queue, logging.StreamHandler())
+    _log_listener.start()
+
 # =============================================================================
 # 1. State & Helper Definitions
 # =============================================================================
 
 class AgentState(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
+    tool_step_count: int       # 현재 턴에서 실행한 tool 스텝 수
+    consecutive_errors: int    # 연속으로 실패한 tool 스텝 수
+
+_SCHEMA_KEYS = ("name", "description", "parameters")
+_TOOL_ATTRS = attrgetter("name", "description", "inputSchema")
+
+# 메시지 content 타입별 문자열 변환 핸들러 (모듈 로드 시 1회 구성)
+# LangChain content는 구체 타입(str/list/dict)이므로 type() 키 조회로 충분
+_CONTENT_HANDLERS = {
+    str: lambda c: c,
+    list: lambda c: "".join(p["text"] for p in c if type(p) is dict and "text" in p),
+    dict: lambda c: c.get("text") or str(c),
+}
 
 def mcp_tools_to_schema(mcp_list_tools_result) -> List[Dict[str, Any]]:
     """MCP Tool 정의를 Gemini가 이해하는 JSON Schema로 변환"""
-    tools_schema = []
-    for tool in mcp_list_tools_result.tools:
-        tools_schema.append({
-            "name": tool.name,
-            "description": tool.description,
-            "parameters": tool.inputSchema
-        })
-    return tools_schema
+    return [
+        dict(zip(_SCHEMA_KEYS, _TOOL_ATTRS(tool)))
+        for tool in mcp_list_tools_result.tools
+    ]
+
+@lru_cache(maxsize=4)
+def _build_client_config(mcp_name: str, transport: str, ip: str, port: int) -> Dict[str, Any]:
+    """MCP Client 연결 설정 생성 (같은 인자로 재호출 시 캐시된 dict 재사용)"""
+    if transport != 'stdio':
+        connection_url = f"http://{ip}:{port}/{transport}"
+        return {
+            str(mcp_name): {
+                "url": str(connection_url),
+                "transport": str(transport),
+            }
+        }
+    else:
+        # stdio 모드: 현재 실행 파일 기준 경로 설정
+        # 주의: __file__이 없는 인터랙티브 환경 고려
+        base_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+        server_script = os.path.join(base_dir, "fastmcp_server.py")
+        return {
+            str(mcp_name): {
+                "transport": "stdio",
+                "command": sys.executable,
+                "args": [server_script],
+            }
+        }
+
+# 시스템 프롬프트: 스키마와 무관하게 고정이므로 모듈 로드 시 1회만 구성
+_FORMATTING_INSTRUCTION = """
+            당신은 전문 의료 데이터 분석 AI입니다.
+            FHIR 데이터를 조회하여 사용자에게 **임상 요약 보고서**를 제공합니다.
+
+            [출력 포맷 규칙 - 엄격 준수]
+            1. 모든 데이터 리스트는 반드시 **Markdown Table(표)** 형식을 사용하세요.
+            2. 텍스트 나열(List)이나 글머리 기호 사용을 금지합니다.
+            3. 데이터가 없을 경우, 해당 섹션 아래에 "일치하는 기록이 없습니다."라고 적으세요.
+            4. 각 섹션의 제목은 `**Bold**`로 처리하세요.
+            """
 
 # =============================================================================
 # 2. Main Chatbot Class
@@ -51,34 +117,135 @@ class ClinicalChatbot:
         self.transport = os.getenv("MCP_TRANSPORT_METHOD", "sse")
         self.ip = os.getenv("MCP_IP", "0.0.0.0")
         self.port = int(os.getenv("MCP_PORT", "8052"))
+        # thread당 유지할 최대 메시지 수 (초과분은 오래된 것부터 삭제)
+        self.max_history = int(os.getenv("MAX_HISTORY_MESSAGES", "40"))
+        # 폭주 방지: 한 턴에서 허용하는 최대 tool 스텝/연속 오류 수
+        self.max_tool_steps = int(os.getenv("MAX_TOOL_STEPS", "8"))
+        self.max_tool_errors = int(os.getenv("MAX_TOOL_ERRORS", "3"))
+        # 개별 tool 호출 제한 시간(초) — 멈춘 MCP 서버가 전체 스텝을 붙잡지 못하도록
+        self.tool_timeout_s = float(os.getenv("MCP_TOOL_TIMEOUT", "30"))
         
         # Internal State
-        self.app = None  # Compiled LangGraph App
         self.checkpointer = MemorySaver() # Persistence
-        self.client_config = self._build_client_config()
-
-    def _build_client_config(self) -> Dict[str, Any]:
-        """MCP Client 연결 설정 생성"""
-        if self.transport != 'stdio':
-            connection_url = f"http://{self.ip}:{self.port}/{self.transport}"
-            return {
-                str(self.mcp_name): {
-                    "url": str(connection_url),
-                    "transport": str(self.transport),
-                }
-            }
-        else:
-            # stdio 모드: 현재 실행 파일 기준 경로 설정
-            # 주의: __file__이 없는 인터랙티브 환경 고려
-            base_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
-            server_script = os.path.join(base_dir, "fastmcp_server.py")
-            return {
-                str(self.mcp_name): {
-                    "transport": "stdio",
-                    "command": sys.executable,
-                    "args": [server_script],
-                }
-            }
+        self.client_config = _build_client_config(self.mcp_name, self.transport, self.ip, self.port)
+        self._mcp = None  # 수명이 긴 MCP 세션 (start_session 동안 유지)
+        # MCPHost 패턴: 서버별 세션 풀과 tool 이름 -> 서버 이름 라우팅 테이블
+        self.sessions: Dict[str, Any] = {}
+        self.tool_registry: Dict[str, str] = {}
+        # 동일한 tool 스키마로 재접속하면 bind_tools 결과를 재사용
+        self._llm_with_tools_cache: Dict[bytes, Any] = {}
+        # start_session에서 교체되는 참조: 노드 메서드들이 매 호출 시 읽음
+        self._llm_with_tools = None
+        self._system_msg = SystemMessage(content=_FORMATTING_INSTRUCTION)
+        # 그래프는 노드가 세션/LLM을 self에서 읽으므로 재접속과 무관하게 1회만 컴파일
+        self.app = self._build_graph()
+
+    def _build_graph(self):
+        """LangGraph 워크플로우를 구성하고 컴파일합니다 (인스턴스당 1회)."""
+        workflow = StateGraph(AgentState)
+        workflow.add_node("trim", self._trim_node)
+        workflow.add_node("agent", self._chatbot_node)
+        workflow.add_node("tools", self._tool_node)
+        workflow.add_edge(START, "trim")
+        workflow.add_edge("trim", "agent")
+        workflow.add_conditional_edges("agent", self._should_continue)
+        workflow.add_edge("tools", "agent")
+        return workflow.compile(checkpointer=self.checkpointer)
+
+    def _trim_node(self, state: AgentState):
+        # MemorySaver는 전체 히스토리를 무한히 누적하므로,
+        # agent 호출 전에 오래된 메시지를 지워 프롬프트 크기를 제한
+        messages = state["messages"]
+        overflow = len(messages) - self.max_history
+        if overflow <= 0:
+            # 새 사용자 턴 시작 시 tool 카운터도 초기화
+            return {"messages": [], "tool_step_count": 0, "consecutive_errors": 0}
+        # ToolMessage가 선행 AIMessage(tool_calls) 없이 고아가 되지 않도록 경계 조정
+        cut = overflow
+        while cut < len(messages) and isinstance(messages[cut], ToolMessage):
+            cut += 1
+        return {
+            "messages": [RemoveMessage(id=m.id) for m in messages[:cut]],
+            "tool_step_count": 0,
+            "consecutive_errors": 0,
+        }
+
+    def _chatbot_node(self, state: AgentState):
+        messages = state["messages"]
+
+        # 시스템 메시지가 맨 앞에 없으면 추가 (가장 강력한 지침으로 작용)
+        if not messages or not isinstance(messages[0], SystemMessage):
+            messages = [self._system_msg] + messages
+
+        return {"messages": [self._llm_with_tools.invoke(messages)]}
+
+    async def _tool_node(self, state: AgentState):
+        last_message = state["messages"][-1]
+        # 핫 패스에서 반복되는 attribute/global 조회를 지역 변수로 고정
+        sessions = self.sessions
+        registry = self.tool_registry
+        TM = ToolMessage
+
+        # 동일한 (name, args) 호출은 한 번만 실행하고 결과를 모든 id에 공유
+        unique_calls = []   # (key, 대표 tool_call)
+        ids_by_key: Dict[Any, List[str]] = {}
+        for tc in last_message.tool_calls:
+            key = (tc["name"], orjson.dumps(tc["args"], option=orjson.OPT_SORT_KEYS))
+            if key not in ids_by_key:
+                ids_by_key[key] = []
+                unique_calls.append((key, tc))
+            ids_by_key[key].append(tc["id"])
+
+        async def _run(tool_call):
+            name = tool_call["name"]
+            args = tool_call["args"]
+            # %s 지연 포맷팅: 레벨 미달이면 문자열 조립 자체를 건너뜀
+            logger.debug("⚙️  [Tool] %s args: %s", name, args)
+            ok = True
+            try:
+                # O(1) 레지스트리 조회로 tool을 소유한 서버 세션 선택
+                session = sessions[registry[name]]
+                result: CallToolResult = await asyncio.wait_for(
+                    session.call_tool(name=name, arguments=args),
+                    timeout=self.tool_timeout_s
+                )
+                content = result.content[0].text if result.content else "No content"
+            except asyncio.TimeoutError:
+                ok = False
+                content = f"Error: tool {name} timed out after {self.tool_timeout_s}s"
+                logger.error("❌ Tool Error: %s", content)
+            except Exception as e:
+                ok = False
+                content = f"Error: {str(e)}"
+                logger.error("❌ Tool Error: %s", content)
+
+            return str(content), ok
+
+        # 병렬 실행: 중복 제거된 호출만 실제로 MCP 서버에 나감
+        results = await asyncio.gather(
+            *(_run(tc) for _, tc in unique_calls)
+        )
+        had_error = any(not ok for _, ok in results)
+        tool_results = [
+            TM(tool_call_id=tid, name=tc["name"], content=content)
+            for (key, tc), (content, _) in zip(unique_calls, results)
+            for tid in ids_by_key[key]
+        ]
+        return {
+            "messages": tool_results,
+            "tool_step_count": state.get("tool_step_count", 0) + 1,
+            "consecutive_errors": state.get("consecutive_errors", 0) + 1 if had_error else 0,
+        }
+
+    def _should_continue(self, state: AgentState) -> Literal["tools", "__end__"]:
+        if state["messages"][-1].tool_calls:
+            # 폭주 방지: 스텝/오류 한도를 넘으면 tool 루프를 강제 종료
+            if (state.get("tool_step_count", 0) >= self.max_tool_steps
+                    or state.get("consecutive_errors", 0) >= self.max_tool_errors):
+                logger.warning("⚠️  Tool loop limit reached; ending turn.")
+                return "__end__"
+            return "tools"
+        return "__end__"
 
     @asynccontextmanager
     async def start_session(self):
@@ -91,80 +258,52 @@ class ClinicalChatbot:
         client = MultiServerMCPClient(self.client_config)
         print(f"🔌 Connecting to MCP Server ({self.transport})...")
 
-        # Start MCP Session
-        async with client.session(self.mcp_name) as mcp:
-            try:
-                formatting_instruction = """
-            당신은 전문 의료 데이터 분석 AI입니다.
-            FHIR 데이터를 조회하여 사용자에게 **임상 요약 보고서**를 제공합니다.
-
-            [출력 포맷 규칙 - 엄격 준수]
-            1. 모든 데이터 리스트는 반드시 **Markdown Table(표)** 형식을 사용하세요.
-            2. 텍스트 나열(List)이나 글머리 기호 사용을 금지합니다.
-            3. 데이터가 없을 경우, 해당 섹션 아래에 "일치하는 기록이 없습니다."라고 적으세요.
-            4. 각 섹션의 제목은 `**Bold**`로 처리하세요.
-            """
-                # 1. Load Tools
-                mcp_tools = await mcp.list_tools()
-                formatted_tools = mcp_tools_to_schema(mcp_tools)
-                print(f"🛠️  Loaded {len(formatted_tools)} tools.")
+        # Start MCP Sessions
+        # AsyncExitStack으로 설정된 모든 서버의 세션을 동시에 열고 self.sessions에 보관:
+        # FastAPI lifespan 동안 모든 /chat 요청이 같은 세션을 재사용 (재접속 비용 제거)
+        async with AsyncExitStack() as stack:
+            async def _connect(server_name: str):
+                session = await stack.enter_async_context(client.session(server_name))
+                tools = await session.list_tools()
+                return server_name, session, tools
 
-                # 2. Setup LLM
-                llm = ChatGoogleGenerativeAI(
+            # 서버 접속/list_tools와 LLM 생성(자격 증명 확인 등)을 동시에 진행
+            *connected, llm = await asyncio.gather(
+                *(_connect(name) for name in self.client_config),
+                asyncio.to_thread(
+                    ChatGoogleGenerativeAI,
                     model=self.model_name,
                     temperature=0,
                     google_api_key=self.api_key
                 )
-                llm_with_tools = llm.bind_tools(formatted_tools)
-                system_msg = SystemMessage(content=formatting_instruction)
-                # 3. Define Graph Nodes (Closure to access 'mcp' session)
-                def chatbot_node(state: AgentState):
-                    
-                    messages = state["messages"]
-                
-                    # 시스템 메시지가 맨 앞에 없으면 추가 (가장 강력한 지침으로 작용)
-                    if not messages or not isinstance(messages[0], SystemMessage):
-                        messages = [system_msg] + messages
-                    
-                    return {"messages": [llm_with_tools.invoke(messages)]}
-
-                async def tool_node(state: AgentState):
-                    last_message = state["messages"][-1]
-                    tool_results = []
-                    for tool_call in last_message.tool_calls:
-                        print(f"⚙️  [Tool] {tool_call['name']} args: {tool_call['args']}")
-                        try:
-                            result: CallToolResult = await mcp.call_tool(
-                                name=tool_call["name"],
-                                arguments=tool_call["args"]
-                            )
-                            content = result.content[0].text if result.content else "No content"
-                        except Exception as e:
-                            content = f"Error: {str(e)}"
-                            print(f"❌ Tool Error: {content}")
-
-                        tool_results.append(ToolMessage(
-                            tool_call_id=tool_call["id"],
-                            name=tool_call["name"],
-                            content=str(content)
-                        ))
-                    return {"messages": tool_results}
-
-                def should_continue(state: AgentState) -> Literal["tools", "__end__"]:
-                    if state["messages"][-1].tool_calls:
-                        return "tools"
-                    return "__end__"
-
-                # 4. Build Graph
-                workflow = StateGraph(AgentState)
-                workflow.add_node("agent", chatbot_node)
-                workflow.add_node("tools", tool_node)
-                workflow.add_edge(START, "agent")
-                workflow.add_conditional_edges("agent", should_continue)
-                workflow.add_edge("tools", "agent")
-
-                self.app = workflow.compile(checkpointer=self.checkpointer)
-                
+            )
+            for server_name, session, _ in connected:
+                self.sessions[server_name] = session
+            self._mcp = self.sessions[self.mcp_name]
+            try:
+                # 1. Load Tools (서버별 스키마를 합치고 tool 이름 -> 서버 라우팅 등록)
+                formatted_tools = []
+                for server_name, _, tools in connected:
+                    server_schemas = mcp_tools_to_schema(tools)
+                    for schema in server_schemas:
+                        self.tool_registry[schema["name"]] = server_name
+                    formatted_tools.extend(server_schemas)
+                print(f"🛠️  Loaded {len(formatted_tools)} tools from {len(connected)} server(s).")
+
+                # 2. Setup LLM (스키마 해시가 같으면 캐시된 바인딩 재사용)
+                schema_key = hashlib.blake2b(
+                    orjson.dumps(formatted_tools, option=orjson.OPT_SORT_KEYS)
+                ).digest()
+                llm_with_tools = self._llm_with_tools_cache.get(schema_key)
+                if llm_with_tools is None:
+                    llm_with_tools = llm.bind_tools(formatted_tools)
+                    self._llm_with_tools_cache[schema_key] = llm_with_tools
+
+                # 3. Swap in session/LLM references
+                # 그래프는 __init__에서 이미 컴파일됨 — 노드 메서드가 self에서 읽는
+                # 참조만 교체하면 재접속 시 그래프 재빌드 비용이 전혀 없음
+                self._llm_with_tools = llm_with_tools
+
                 # Yield control back to the caller
                 yield self
 
@@ -172,53 +311,59 @@ class ClinicalChatbot:
                 print(f"❌ Session Error: {e}")
                 raise
             finally:
-                self.app = None
+                self._llm_with_tools = None
+                self._mcp = None
+                self.sessions.clear()
+                self.tool_registry.clear()
                 print("🔌 MCP Session Closed.")
 
-    async def chat(self, user_input: str, thread_id: str = "default_session") -> str:
+    async def chat(self, user_input: str, thread_id: str = "default_session", stream: bool = False) -> str:
         """
         [Public API] 사용자의 자연어 입력을 받아 봇의 자연어 응답을 반환합니다.
-        
+
         Args:
             user_input (str): 사용자 질문
             thread_id (str): 대화 컨텍스트 유지를 위한 세션 ID
-            
+            stream (bool): True면 astream으로 중간 이벤트까지 순회 (SSE 용도),
+                           False면 ainvoke로 최종 상태만 받음 (기본, /chat 엔드포인트)
+
         Returns:
             str: 봇의 최종 응답
         """
-        if self.app is None:
+        if self._llm_with_tools is None:
             return "❌ Error: Session not started. Use 'async with bot.start_session():'"
 
         config = {"configurable": {"thread_id": thread_id}}
-        final_response = ""
 
         try:
-            # Stream events to process output
-            async for event in self.app.astream(
+            if stream:
+                # Stream events to process output
+                final_response = ""
+                async for event in self.app.astream(
+                    {"messages": [HumanMessage(content=user_input)]},
+                    config=config
+                ):
+                    # We only care about the final response from the agent node
+                    if "agent" in event:
+                        msg = event["agent"]["messages"][-1]
+                        if msg.content:
+                            final_response = self._parse_content(msg.content)
+                return final_response
+
+            # 비스트리밍 응답: 이벤트 순회 없이 최종 상태의 마지막 메시지만 읽음
+            state = await self.app.ainvoke(
                 {"messages": [HumanMessage(content=user_input)]},
                 config=config
-            ):
-                # We only care about the final response from the agent node
-                if "agent" in event:
-                    msg = event["agent"]["messages"][-1]
-                    if msg.content:
-                        final_response = self._parse_content(msg.content)
-        
+            )
+            msg = state["messages"][-1]
+            return self._parse_content(msg.content) if msg.content else ""
+
         except Exception as e:
             return f"Error during processing: {str(e)}"
 
-        return final_response
-
     def _parse_content(self, content: Any) -> str:
         """LangChain 메시지 content를 순수 문자열로 변환하는 헬퍼"""
-        if isinstance(content, str):
-            return content
-        elif isinstance(content, list):
-            # 텍스트 파트만 결합
-            return "".join([part.get("text", "") for part in content if isinstance(part, dict)])
-        elif isinstance(content, dict):
-            return content.get("text", str(content))
-        return str(content)
+        return _CONTENT_HANDLERS.get(type(content), str)(content)
 
 # =============================================================================
 # 3. Execution Example
@@ -234,7 +379,8 @@ async def main():
         
         # 3. 대화 루프
         while True:
-            user_in = input("\n👤 User: ")
+            # input()은 스레드를 블로킹하므로 워커 스레드로 보내 이벤트 루프(SSE keepalive 등)를 살려둠
+            user_in = await asyncio.to_thread(input, "\n👤 User: ")
             if user_in.lower() in ["exit", "quit"]:
                 break
             
@@ -246,4 +392,8 @@ async def main():
 if __name__ == "__main__":
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    else:
+        # POSIX에서는 libuv 기반 uvloop로 교체 (SSE 같은 잦은 소켓 I/O에 유리)
+        import uvloop
+        uvloop.install()
     asyncio.run(main())
\ No newline at end of file
@@ -1,6 +1,7 @@
 import asyncio
 import os
 import sys
+from operator import attrgetter
 from typing import Annotated, Literal, List
 from typing_extensions import TypedDict
 
@@ -52,16 +53,15 @@ class AgentState(TypedDict):
     # add_messages: 이전 대화 내용을 계속 리스트에 누적(Append)하는 Reducer
     messages: Annotated[List[BaseMessage], add_messages]
 
+_SCHEMA_KEYS = ("name", "description", "parameters")
+_TOOL_ATTRS = attrgetter("name", "description", "inputSchema")
+
 def mcp_tools_to_schema(mcp_list_tools_result):
     """MCP Tool 정의를 Gemini가 이해하는 JSON Schema로 변환"""
-    tools_schema = []
-    for tool in mcp_list_tools_result.tools:
-        tools_schema.append({
-            "name": tool.name,
-            "description": tool.description,
-            "parameters": tool.inputSchema
-        })
-    return tools_schema
+    return [
+        dict(zip(_SCHEMA_KEYS, _TOOL_ATTRS(tool)))
+        for tool in mcp_list_tools_result.tools
+    ]
 
 # =============================================================================
 # 2. Main Chat Application
@@ -107,18 +107,23 @@ async def run_chat_app():
         # [Node 2] 도구 실행(Tool) 노드
         async def tool_node(state: AgentState):
             last_message = state["messages"][-1]
-            tool_results = []
+            # 핫 패스에서 반복되는 attribute/global 조회를 지역 변수로 고정
+            call = mcp.call_tool
+            TM = ToolMessage
+
+            async def _run(tool_call):
+                name = tool_call["name"]
+                args = tool_call["args"]
+                tid = tool_call["id"]
+                print(f"\n⚙️  [Tool Call] {name} (Args: {args})")
 
-            for tool_call in last_message.tool_calls:
-                print(f"\n⚙️  [Tool Call] {tool_call['name']} (Args: {tool_call['args']})")
-                
                 try:
                     # MCP 세션을 사용하여 실제 도구 호출
-                    result: CallToolResult = await mcp.call_tool(
-                        name=tool_call["name"],
-                        arguments=tool_call["args"]
+                    result: CallToolResult = await call(
+                        name=name,
+                        arguments=args
                     )
-                    
+
                     # 결과 텍스트 추출
                     content = result.content[0].text if result.content else "No content returned."
                     print(f"   ✅ Result: {content[:100]}..." if len(content) > 100 else f"   ✅ Result: {content}")
@@ -128,13 +133,17 @@ async def run_chat_app():
                     print(f"   ❌ Error: {content}")
 
                 # 결과 메시지 생성
-                tool_results.append(ToolMessage(
-                    tool_call_id=tool_call["id"],
-                    name=tool_call["name"],
+                return TM(
+                    tool_call_id=tid,
+                    name=name,
                     content=str(content)
-                ))
-            
-            return {"messages": tool_results}
+                )
+
+            # N개의 tool_call을 병렬 실행 (gather는 입력 순서를 보존함)
+            tool_results = await asyncio.gather(
+                *(_run(tc) for tc in last_message.tool_calls)
+            )
+            return {"messages": list(tool_results)}
 
         # [Edge] 조건부 분기
         def should_continue(state: AgentState) -> Literal["tools", "__end__"]:
@@ -170,7 +179,8 @@ async def run_chat_app():
 
         while True:
             try:
-                user_input = input("\n👤 User: ")
+                # input()은 스레드를 블로킹하므로 워커 스레드로 보내 이벤트 루프를 살려둠
+                user_input = await asyncio.to_thread(input, "\n👤 User: ")
                 if user_input.lower() in ["exit", "quit", "그만"]:
                     print("👋 Chat session ended.")
                     break
@@ -205,6 +215,10 @@ if __name__ == "__main__":
     # Windows 환경 asyncio 정책 설정 (필요시)
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-        
+    else:
+        # POSIX에서는 libuv 기반 uvloop로 교체 (SSE 같은 잦은 소켓 I/O에 유리)
+        import uvloop
+        uvloop.install()
+
     asyncio.run(run_chat_app())
     
\ No newline at end of file
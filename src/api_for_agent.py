@@ -1,7 +1,6 @@
 # server.py
 import asyncio
 from contextlib import asynccontextmanager
-from json import load
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import Optional
@@ -94,5 +93,6 @@ async def chat_endpoint(request: ChatRequest):
 
 if __name__ == "__main__":
     import uvicorn
-    # uvicorn server:app --reload 와 동일
-    uvicorn.run("api_for_agent:app", host=API_IP, port=API_PORT, reload=True)
\ No newline at end of file
+    # uvicorn server:app --reload 와 동일 (POSIX에서는 uvloop 이벤트 루프 사용)
+    loop_impl = "auto" if os.name == "nt" else "uvloop"
+    uvicorn.run("api_for_agent:app", host=API_IP, port=API_PORT, reload=True, loop=loop_impl)
\ No newline at end of file
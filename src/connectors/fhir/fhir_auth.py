@@ -1,9 +1,16 @@
+import asyncio
+import time
+
 import requests
+import httpx
 ##get
 
+# 만료 직전 미리 갱신하기 위한 여유 시간(초)
+TOKEN_EXPIRY_SKEW = 60
+
 class FHIRClient:
-    def __init__(self, token_url, client_id, client_secret, grant_type, resource_value):        
-        # 1. 설정 값 입력 
+    def __init__(self, token_url, client_id, client_secret, grant_type, resource_value, async_client=None):
+        # 1. 설정 값 입력
         self.token_url = token_url # FHIR_TOKEN_ENDPOINT
         self.client_id = client_id # FHIR_CLIENT_ID
         self.client_secret = client_secret # FHIR_CLIENT_SECRET
@@ -11,31 +18,54 @@ class FHIRClient:
         self.resource_value = resource_value
         # 발급받은 토큰을 저장할 변수
         self.access_token = None
+        # 토큰 만료 시각 (time.monotonic 기준). 만료 전에는 재발급하지 않음
+        self._expires_at = 0.0
+        # 동시 갱신 방지용 single-flight 락
+        self._refresh_lock = asyncio.Lock()
+        # 비동기 토큰 요청용 공유 클라이언트 (주입 가능, 없으면 최초 사용 시 생성)
+        self._async_client = async_client
+
+    def token_valid(self):
+        """현재 토큰이 존재하고 아직 만료되지 않았는지 확인합니다."""
+        return bool(self.access_token) and time.monotonic() < self._expires_at
+
+    def _store_token(self, token_data):
+        self.access_token = token_data.get("access_token")
+        expires_in = int(token_data.get("expires_in", 3600))
+        self._expires_at = time.monotonic() + expires_in - TOKEN_EXPIRY_SKEW
+
+    def _has_credentials(self):
+        return (self.token_url is not None) and (self.client_id is not None) \
+            and (self.client_secret is not None) and (self.grant_type == "Client_Credentials")
+
+    def _build_payload(self):
+        payload = {
+            "grant_type": self.grant_type,
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            # 만약 scope가 필요하다면 아래 주석 해제 (예: "system/*.read")
+            # "scope": "system/*.read"
+        }
+        if self.resource_value:
+            payload["resource"] = self.resource_value
+        return payload
 
     def get_access_token(self):
         """
         인증 서버(Token Endpoint)에 자격 증명을 보내 Access Token을 받아옵니다.
+        (동기 버전 — 이벤트 루프 밖에서만 사용할 것. 루프 안에서는 aget_access_token 사용)
         """
-        if (self.token_url is not None) and (self.client_id is not None) and (self.client_secret is not None) and (self.grant_type == "Client_Credentials"):
-            
-            payload = {
-                "grant_type": self.grant_type,
-                "client_id": self.client_id,
-                "client_secret": self.client_secret,            
-                # 만약 scope가 필요하다면 아래 주석 해제 (예: "system/*.read")
-                # "scope": "system/*.read" 
-            }
-            if self.resource_value:
-                payload["resource"] = self.resource_value
+        if self._has_credentials():
+            payload = self._build_payload()
 
             try:
                 # POST 요청으로 토큰 발급 시도
                 response = requests.post(self.token_url, data=payload)
                 response.raise_for_status() # 200 OK가 아니면 에러 발생
-                
+
                 token_data = response.json()
-                self.access_token = token_data.get("access_token")
-                
+                self._store_token(token_data)
+
                 print(f"[Success] 토큰 발급 완료: {self.access_token[:10]}...")
                 return self.access_token
 
@@ -46,20 +76,69 @@ class FHIRClient:
                 return None
         else:
             self.access_token = None
-            return self.access_token        
+            return self.access_token
+
+    async def aget_access_token(self):
+        """
+        인증 서버(Token Endpoint)에 자격 증명을 보내 Access Token을 받아옵니다.
+        (비동기 버전 — requests와 달리 이벤트 루프를 블로킹하지 않음)
+        """
+        if not self._has_credentials():
+            self.access_token = None
+            return self.access_token
+
+        payload = self._build_payload()
+
+        if self._async_client is None:
+            # keep-alive 풀을 가진 장수명 클라이언트를 재사용
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5)
+            )
+
+        response = None
+        try:
+            response = await self._async_client.post(self.token_url, data=payload)
+            response.raise_for_status()
+
+            token_data = response.json()
+            self._store_token(token_data)
+
+            print(f"[Success] 토큰 발급 완료: {self.access_token[:10]}...")
+            return self.access_token
+
+        except httpx.HTTPError as e:
+            print(f"[Error] 토큰 발급 실패: {e}")
+            if response is not None:
+                print(f"서버 응답: {response.text}")
+            return None
 
     def get_headers(self):
         """
         FHIR 요청 시 사용할 헤더를 생성합니다 (Authorization 포함).
         """
-        if not self.access_token:
-            self.get_access_token() # 토큰이 없으면 발급 시도
+        if not self.token_valid():
+            self.get_access_token() # 토큰이 없거나 만료됐으면 발급 시도
+
+        return self._build_headers()
 
+    async def aget_headers(self):
+        """
+        FHIR 요청 시 사용할 헤더를 생성합니다 (비동기 버전).
+        """
+        if not self.token_valid():
+            # single-flight: 동시에 여러 요청이 와도 토큰 엔드포인트는 한 번만 호출
+            async with self._refresh_lock:
+                if not self.token_valid():
+                    await self.aget_access_token()
+
+        return self._build_headers()
+
+    def _build_headers(self):
         result_value ={
-                "Accept": "application/fhir+json",                                
+                "Accept": "application/fhir+json",
             }
-        
+
         if self.access_token:
             result_value["Authorization"] = f"Bearer {self.access_token}"
-        
-        return result_value
\ No newline at end of file
+
+        return result_value
@@ -1,5 +1,6 @@
 import httpx
-import json
+import ijson
+import orjson
 import asyncio
 from typing import Optional, Dict, Any, List
 from urllib.parse import urlencode
@@ -7,57 +8,324 @@ from urllib.parse import urlencode
 # 같은 폴더에 있는 helper.py를 import 한다고 가정합니다.
 from . import helper
 from .fhir_auth import FHIRClient
-import copy
+from collections import deque, OrderedDict
+from functools import lru_cache
+from types import MappingProxyType
 # ResourceType은 문자열로 처리
 ResourceType = str
 MEDICATION_INFO_RESOURCE = "Medication"
+# 자주 쓰는 리소스의 URL 경로를 미리 계산 (호출마다 f-string 조립 제거)
+_RESOURCE_PATHS = {rt: f"/{rt}" for rt in (
+    "Patient", "Observation", "Condition", "Procedure", "Encounter",
+    "MedicationRequest", "MedicationDispense", "MedicationAdministration",
+    "MedicationStatement", "DiagnosticReport", "DocumentReference",
+    "AllergyIntolerance", "FamilyMemberHistory", "Immunization", "Medication",
+)}
+# resolve_patient_id 캐시 최대 크기 (세션당 환자 수 기준 넉넉한 값)
+_PATIENT_ID_CACHE_MAX = 256
+# ETag 재검증 캐시 최대 항목 수
+_ETAG_CACHE_MAX = 128
+# 이 크기를 넘는 응답은 파싱+포맷팅을 워커 스레드로 넘김 (이벤트 루프 비블로킹)
+_FORMAT_OFFLOAD_BYTES = 64 * 1024
+# 목록 조회 시 페이지를 따라가며 모으는 entry 수 상한
+_SEARCH_PAGE_LIMIT = 100
+# Medication 포맷 결과 캐시 최대 항목 수
+_MED_CACHE_MAX = 1024
+# 마크다운 표 셀에서 줄바꿈을 공백으로 치환하는 변환 테이블 (replace 체인보다 빠름)
+_NL_TABLE = str.maketrans({"\n": " ", "\r": " "})
+
+@lru_cache(maxsize=64)
+def _header_rows(headers: tuple) -> tuple:
+    # 헤더/구분선은 헤더 튜플에만 의존 — 같은 스키마의 표가 반복 생성되므로 memoize
+    join_cells = " | ".join
+    return (
+        "| " + join_cells(headers) + " |",
+        "| " + join_cells(("---",) * len(headers)) + " |",
+    )
+
+def _wrap(text: str) -> Dict[str, Any]:
+    # MCP 응답 envelope. 모든 메서드가 마지막에 거치므로 모듈 함수로 두어
+    # self attribute 조회/메서드 디스패치 없이 dict 리터럴만 실행되게 함
+    return {"content": [{"type": "text", "text": text}]}
+
+class _BearerAuth(httpx.Auth):
+    """Bearer 헤더 값을 1회만 조립해 두고 요청마다 재사용하는 httpx Auth."""
+    def __init__(self, token: str):
+        self._header = f"Bearer {token}"
+
+    def auth_flow(self, request):
+        request.headers["Authorization"] = self._header
+        yield request
 
 class FhirClient:
-    def __init__(self, base_url: str, grant_type=None, token_url=None, client_id=None, client_secret=None, resource_value=None):
+    # 호출마다 동일한 정적 파라미터는 읽기 전용 템플릿으로 두고 dict()로 복사해서 시작
+    _OBSERVATION_LIST_PARAMS = MappingProxyType({
+        '_sort': '-date',
+        '_count': '100',
+    })
+
+    def __init__(self, base_url: str, grant_type=None, token_url=None, client_id=None, client_secret=None, resource_value=None, max_inflight: int = 16):
         self.fhir_auth_client = FHIRClient(token_url, client_id, client_secret, grant_type, resource_value)
-        self.access_token: Optional[str] = self.fhir_auth_client.get_access_token()
+        # 토큰은 첫 요청 직전에 루프 안에서 비동기로 발급 (생성자가 HTTP로 블로킹하지 않음)
+        self.access_token: Optional[str] = None
         self.client = httpx.AsyncClient(
             base_url=base_url,
+            # summary 계열은 같은 호스트로 GET을 동시에 쏘므로 기본 풀(keepalive 10)로는
+            # 버스트 중간에 TCP/TLS 핸드셰이크가 다시 발생함. 풀을 넉넉히 잡고
+            # HTTP/2를 켜서 가능한 경우 단일 연결 위에서 멀티플렉싱되게 함
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=256,
+                max_keepalive_connections=64,
+                keepalive_expiry=30.0,
+            ),
+            # 대용량 bundle 응답은 10초를 넘길 수 있어 읽기 제한은 넉넉히, 연결은 짧게
+            timeout=httpx.Timeout(30.0, connect=5.0),
             headers={
-                "Accept": "application/fhir+json",
-                # Authorization은 set_access_token에서 설정
-                "Authorization": f"Bearer {self.access_token}" if self.access_token else ""
-            }
+                # 버전을 명시해 일부 서버가 더 큰 기본 프로파일로 응답하는 것을 방지
+                "Accept": "application/fhir+json;fhirVersion=4.0",
+                # FHIR bundle은 압축률이 매우 높음 (pretty JSON 수 MB -> 수십 KB 수준)
+                # brotli 설치 시 httpx가 br 응답을 투명하게 해제함
+                "Accept-Encoding": "gzip, deflate, br",
+            },
+            # Authorization은 Auth 훅에서 주입 (_ensure_token이 발급 후 설정)
         )
+        # MRN(identifier) -> FHIR Patient id 해석 결과 캐시 (수동 LRU: dict + deque)
+        self._patient_id_cache: Dict[str, str] = {}
+        self._patient_id_lru: deque = deque()
+        # batch Bundle 지원 여부 (None=미확인, 첫 batch_search 시도에서 판별)
+        self._batch_supported: Optional[bool] = None
+        # 동시 in-flight 요청 상한: gather 폭주로 FHIR 서버가 429를 내는 것을 방지
+        # (Limits는 소켓 수를, 세마포어는 논리적 동시성을 제한)
+        self._sem = asyncio.Semaphore(max_inflight)
+        # ETag 재검증 캐시: (url+params) -> (etag, 응답). 304면 본문 전송/파싱을 통째로 생략
+        self._etag_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        # Medication id -> 포맷된 약물 정보 문자열 (처방/조제/투여 행에 같은 참조가 반복됨)
+        self._med_cache: "OrderedDict[str, str]" = OrderedDict()
+        # 최초 토큰 발급 single-flight 락 (동시 첫 요청이 토큰 엔드포인트를 중복 호출하지 않게)
+        self._token_lock = asyncio.Lock()
 
     def set_access_token(self, token: str):
         self.access_token = token
-        self.client.headers["Authorization"] = f"Bearer {self.access_token}"
+        self.client.auth = _BearerAuth(token)
+
+    async def _ensure_token(self):
+        """
+        유효한 토큰이 없으면 요청 직전에 비동기로 발급받아 Auth 훅에 반영합니다.
+        만료 판정은 fhir_auth의 monotonic 기준을 그대로 사용합니다.
+        """
+        auth = self.fhir_auth_client
+        if auth.token_valid() or not auth._has_credentials():
+            return
+        async with self._token_lock:
+            if auth.token_valid():
+                return
+            token = await auth.aget_access_token()
+            if token:
+                self.set_access_token(token)
+
+    async def aclose(self):
+        """연결 풀을 정리합니다 (서버 종료 시 호출)."""
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def _get(self, url: str, **kwargs) -> httpx.Response:
+        await self._ensure_token()
+        params = kwargs.get("params")
+        try:
+            if params:
+                items = params.items() if hasattr(params, "items") else params
+                cache_key = f"{url}?{urlencode(sorted(items), doseq=True)}"
+            else:
+                cache_key = url
+        except TypeError:
+            cache_key = None  # 정렬 불가능한 params는 캐시 대상에서 제외
+        cached = self._etag_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers["If-None-Match"] = cached[0]
+            kwargs["headers"] = headers
+
+        # 모든 GET이 이 관문을 지나므로 호출부가 얼마나 gather를 하든 상한이 지켜짐
+        async with self._sem:
+            response = await self.client.get(url, **kwargs)
+
+        if cached is not None and response.status_code == 304:
+            # 변경 없음: 본문 0 바이트, JSON 파싱도 캐시된 응답 재사용으로 생략
+            self._etag_cache.move_to_end(cache_key)
+            return cached[1]
+        etag = response.headers.get("ETag")
+        if cache_key and etag and response.status_code == 200:
+            self._etag_cache[cache_key] = (etag, response)
+            self._etag_cache.move_to_end(cache_key)
+            if len(self._etag_cache) > _ETAG_CACHE_MAX:
+                self._etag_cache.popitem(last=False)
+        return response
+
+    def _decode(self, response: httpx.Response) -> Any:
+        # stdlib json보다 수 배 빠른 C 파서로 FHIR bundle 디코딩 (이벤트 루프 블로킹 최소화)
+        return orjson.loads(response.content)
+
+    async def _get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        GET + orjson 디코딩. 응답을 청크 단위로 수신해 bytearray에 모으므로
+        수신 중에도 다른 코루틴이 진행되고, 본문이 크면 파싱을 워커 스레드로
+        넘겨 이벤트 루프가 한 번에 길게 블로킹되지 않습니다.
+        """
+        await self._ensure_token()
+        kwargs: Dict[str, Any] = {"params": params} if params else {}
+        async with self._sem, self.client.stream("GET", path, **kwargs) as response:
+            response.raise_for_status()
+            buf = bytearray()
+            async for chunk in response.aiter_bytes(65536):
+                buf.extend(chunk)
+        if len(buf) > _FORMAT_OFFLOAD_BYTES:
+            return await asyncio.to_thread(orjson.loads, bytes(buf))
+        return orjson.loads(bytes(buf))
+
+    async def _iter_search(self, path: str, params: Optional[Dict[str, Any]] = None,
+                           max_entries: Optional[int] = None):
+        """
+        Bundle.link[next]를 따라가며 entry를 순서대로 yield하는 async generator.
+        서버 페이지 크기가 작아도 상한까지 이어서 받고, 호출자가 상한에서 끊으면
+        다음 페이지의 요청/파싱 자체가 일어나지 않습니다.
+        """
+        yielded = 0
+        bundle = await self._get_json(path, params)
+        while True:
+            for entry in bundle.get('entry') or []:
+                yield entry
+                yielded += 1
+                if max_entries is not None and yielded >= max_entries:
+                    return
+            links = bundle.get('link') or []
+            next_url = next((l.get('url') for l in links if l.get('relation') == 'next'), None)
+            if not next_url:
+                return
+            # next 링크는 절대 URL — httpx가 base_url 없이 그대로 사용
+            bundle = await self._get_json(next_url)
+
+    async def _stream_entries(self, path: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        큰 bundle을 통째로 materialize하지 않고 entry 단위로 증분 파싱합니다.
+        수 MB bundle에서도 peak 메모리가 entry 몇 개 분량으로 유지됩니다.
+        (작은 응답은 파서 셋업 비용 때문에 전체 파싱(_decode)이 더 쌉니다)
+        """
+        await self._ensure_token()
+        entries: List[Dict[str, Any]] = []
+        pending = ijson.sendable_list()
+        coro = ijson.items_coro(pending, 'entry.item')
+        async with self._sem, self.client.stream("GET", path, params=params) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                try:
+                    coro.send(chunk)
+                except StopIteration:
+                    break
+                if pending:
+                    entries.extend(pending)
+                    del pending[:]
+        entries.extend(pending)
+        return entries
+
+    async def resolve_patient_id(self, ident: Any) -> Any:
+        """
+        'system|value' 형식의 identifier(MRN 등)를 실제 FHIR Patient id로 해석합니다.
+        일반 FHIR id는 조회 없이 그대로 통과하고, 해석 결과는 세션 내 캐시되어
+        같은 환자에 대한 반복 tool 호출에서 /Patient 왕복을 제거합니다.
+        """
+        if not ident or '|' not in str(ident):
+            return ident
+        ident = str(ident)
+        cached = self._patient_id_cache.get(ident)
+        if cached is not None:
+            return cached
+
+        response = await self._get("/Patient", params={'identifier': ident, '_count': '1'})
+        bundle = self._decode(response)
+        entry = bundle.get('entry') or []
+        resolved = entry[0].get('resource', {}).get('id') if entry else None
+        if not resolved:
+            return ident  # 해석 실패 시 원본 유지 (캐시하지 않음)
+
+        if len(self._patient_id_cache) >= _PATIENT_ID_CACHE_MAX:
+            oldest = self._patient_id_lru.popleft()
+            self._patient_id_cache.pop(oldest, None)
+        self._patient_id_cache[ident] = resolved
+        self._patient_id_lru.append(ident)
+        return resolved
+
+    async def batch_search(self, entries: List[tuple]) -> List[Any]:
+        """
+        여러 검색을 FHIR batch Bundle 하나로 묶어 POST / 한 번에 실행합니다.
+        N개의 검색이 N번의 RTT + 서버 dispatch 대신 1번으로 끝납니다.
+        반환 순서는 입력 entries 순서와 동일합니다.
 
-    async def search(self, resource_type: str, params: Dict[str, Any] = {}) -> Any:
-        response = await self.client.get(f"/{resource_type}", params=params)
-        response.raise_for_status()
-        return response.json()
+        Args:
+            entries: (resource_type, params dict) 튜플 리스트
+        """
+        if self._batch_supported is not False:
+            await self._ensure_token()
+            bundle = {
+                "resourceType": "Bundle",
+                "type": "batch",
+                "entry": [
+                    {"request": {"method": "GET",
+                                 "url": f"{resource_type}?{urlencode(params, doseq=True)}" if params else resource_type}}
+                    for resource_type, params in entries
+                ],
+            }
+            try:
+                response = await self.client.post(
+                    "/",
+                    content=orjson.dumps(bundle),
+                    headers={"Content-Type": "application/fhir+json"},
+                )
+                response.raise_for_status()
+                self._batch_supported = True
+                result = self._decode(response)
+                return [e.get('resource') for e in result.get('entry', [])]
+            except httpx.HTTPError:
+                # batch 미지원 서버(400/405 등): 이번 요청부터 병렬 GET으로 폴백
+                self._batch_supported = False
+
+        results = await asyncio.gather(
+            *(self.search(resource_type, params) for resource_type, params in entries)
+        )
+        return list(results)
+
+    async def search(self, resource_type: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        path = _RESOURCE_PATHS.get(resource_type) or f"/{resource_type}"
+        # params 없는 호출은 params= 자체를 생략해 httpx의 쿼리 인코딩을 건너뜀
+        return await self._get_json(path, params if params else None)
 
     async def get(self, resource_type: str, id: str) -> Any:
-        response = await self.client.get(f"/{resource_type}/{id}")
-        response.raise_for_status()
-        return response.json()
+        return await self._get_json(f"{_RESOURCE_PATHS.get(resource_type) or '/' + resource_type}/{id}")
 
     async def execute_query(self, query_params: Any):
         params = self._build_search_params(query_params)
-        # params가 str일 경우 직접 url에 붙이고, dict일 경우 params 인자로 전달
-        if isinstance(params, str):
-            response = await self.client.get(f"/{query_params['resourceType']}?{params}")
-        else:
-            response = await self.client.get(f"/{query_params['resourceType']}", params=params)
-            
+        response = await self._get(f"/{query_params['resourceType']}", params=params)
         # 일반 쿼리는 결과 포맷터가 특정되지 않았으므로 기본 JSON 덤프 사용
-        return self._format_results(response.json(), query_params['resourceType'])
+        return self._format_results(self._decode(response), query_params['resourceType'])
 
     async def get_active_conditions(self):
-        response = await self.client.get('/Condition?clinical-status=active')
-        formatted_text = helper.format_conditions(response.json())
-        return self._format_response_text(formatted_text)
+        response = await self._get('/Condition?clinical-status=active')
+        formatted_text = helper.format_conditions(self._decode(response))
+        return _wrap(formatted_text)
 
     async def find_patient(self, args: Dict[str, Any]):
         params = {}
-        if args.get('id'):
+        if args.get('identifier'):
+            # MRN 등 정확한 identifier가 있으면 인덱스 동등 조회로 직행
+            # (이름/생년월일 검색보다 서버 부담이 훨씬 적고 결과도 1건)
+            params['identifier'] = args['identifier']
+            params['_count'] = '1'
+        elif args.get('id'):
             params['_id'] = args['id']
         else:
             if args.get('_sort'):
@@ -70,61 +338,75 @@ class FhirClient:
             if args.get('birthDate'): params['birthdate'] = args['birthDate']
             if args.get('gender'): params['gender'] = args['gender'] #it is not work in fhir interface
             if args.get('lastUpdated'): params['_lastUpdated'] = args['lastUpdated']
-            
-        response = await self.client.get("/Patient", params=params)
-        formatted_result = helper.format_patient_search_results(response.json(), args)
+            # 성+이름+생년월일이 모두 있으면 사실상 유일 식별 — 첫 매치만 받아 서버 부담 축소
+            if args.get('lastName') and args.get('firstName') and args.get('birthDate'):
+                params['_count'] = '1'
+
+        response = await self._get("/Patient", params=params)
+        formatted_result = helper.format_patient_search_results(self._decode(response), args)
         mk_table = self._dicts_to_markdown_table(formatted_result, resource_type='Patient')
         return mk_table
 
     def handle_error(self, error: Any):
-        if isinstance(error, httpx.HTTPStatusError) or isinstance(error, httpx.RequestError):
+        if isinstance(error, (httpx.HTTPStatusError, httpx.RequestError)):
+            # bare except는 KeyboardInterrupt/SystemExit까지 삼키므로
+            # OperationOutcome 파싱 실패 유형만 좁혀서 잡는다
+            # (RequestError에는 response가 없어 AttributeError가 남)
             try:
-                error_data = error.response.json()
-                details = error_data.get('issue', [{}])[0].get('details', {}).get('text')
+                content = error.response.content
+                # JSON 객체가 아닌 본문(HTML 에러 페이지, 빈 응답)은 파싱 시도 없이 스킵
+                details = None
+                if content and content.lstrip()[:1] == b'{':
+                    error_data = orjson.loads(content)
+                    details = error_data.get('issue', [{}])[0].get('details', {}).get('text')
                 error_msg = f"FHIR API error: {details or str(error)}"
-            except:
+            except (orjson.JSONDecodeError, AttributeError, KeyError, IndexError, TypeError):
                 error_msg = f"FHIR API error: {str(error)}"
         else:
             error_msg = str(error)
             
         return {"content": [{"type": "text", "text": error_msg}], "isError": True}
 
-    def _build_search_params(self, query_params: Any) -> Any:
-        # httpx 호환을 위해 Dict로 반환하거나, 복잡한 로직(중복 키 등)을 위해 str로 반환
-        params = {}
+    def _apply_date_range(self, params: Dict[str, Any], args: Dict[str, Any]) -> None:
+        """dateFrom/dateTo를 FHIR date 검색 파라미터(ge/le 접두)로 변환해 params에 추가합니다."""
+        date_from = args.get('dateFrom')
+        date_to = args.get('dateTo')
+        if date_from or date_to:
+            # httpx는 동일 키의 리스트 값을 date=ge...&date=le...로 인코딩함
+            dates = params.setdefault('date', [])
+            if date_from: dates.append(f"ge{date_from}")
+            if date_to: dates.append(f"le{date_to}")
+
+    def _build_search_params(self, query_params: Any) -> List[tuple]:
+        # (key, value) 튜플 리스트: httpx가 중복 키를 그대로 인코딩함 (date=ge...&date=le...)
+        # 중간 dict/list 조립 없이 한 번에 구성
+        params: List[tuple] = []
         if query_params.get('codes'):
-            params['code'] = ','.join(query_params['codes'])
-        
+            params.append(('code', ','.join(query_params['codes'])))
+
         date_range = query_params.get('dateRange')
         if date_range:
-            # httpx는 동일 키에 대한 리스트 값을 지원합니다 (예: date=ge...&date=le...)
-            dates = []
-            if date_range.get('start'): dates.append(f"ge{date_range['start']}")
-            if date_range.get('end'): dates.append(f"le{date_range['end']}")
-            if dates:
-                params['date'] = dates
+            if date_range.get('start'): params.append(('date', f"ge{date_range['start']}"))
+            if date_range.get('end'): params.append(('date', f"le{date_range['end']}"))
 
         return params
 
-    def _format_results(self, data: Any, resource_type: ResourceType):
-        # Fallback for generic queries
-        return {"content": [{"type": "text", "text": json.dumps(data, indent=2)}]}
+    def _format_results(self, data: Any, resource_type: ResourceType, pretty: bool = False):
+        # Fallback for generic queries — 소비자가 LLM이므로 기본은 들여쓰기 없이 덤프
+        # (직렬화가 빨라지고 컨텍스트에 들어가는 문자열도 ~40% 짧아짐)
+        option = orjson.OPT_INDENT_2 if pretty else 0
+        return {"content": [{"type": "text", "text": orjson.dumps(data, option=option).decode()}]}
 
     def _format_response_text(self, text: str):
-        # 헬퍼가 생성한 텍스트를 반환 포맷에 맞게 래핑
-        return {
-            "content": [{
-                "type": "text",
-                "text": text
-            }]
-        }
+        # 이전 코드 호환용 — 실제 구현은 모듈 함수 _wrap
+        return _wrap(text)
 
     # 이전 코드 호환용 (JSON 덤프가 필요한 경우)
-    def _format_response(self, uri: str, data: Any):
+    def _format_response(self, uri: str, data: Any, pretty: bool = False):
         return {
             "content": [{
                 "type": "text",
-                "text": json.dumps(data, indent=2)
+                "text": orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0).decode()
             }]
         }
 
@@ -135,265 +417,285 @@ class FhirClient:
         if not data_list or not isinstance(data_list, list):
             return "No matching records found."
 
-        # 1. 헤더 추출 (첫 번째 딕셔너리의 키 기준) -> 전체 딕셔너리를 확인해서, 모든 key를 헤더로 만든다.
-        header_list = []
-        header_seen = set()
-        for row in data_list:
-            if not isinstance(row, dict):
-                continue
-            for key in row.keys():
-                if key not in header_seen:
-                    header_seen.add(key)
-                    header_list.append(key)
-        if not header_list:
+        # 1. dict 행만 한 번 걸러내 아래 핫 루프에서 isinstance 분기를 제거
+        dict_rows = [row for row in data_list if isinstance(row, dict)]
+        # 헤더 추출 -> 전체 딕셔너리를 확인해서, 모든 key를 헤더로 만든다.
+        # dict가 삽입 순서를 보존하며 C 레벨에서 dedupe하므로 set 조회 루프가 불필요
+        headers = list({k: None for row in dict_rows for k in row})
+        if not headers:
             return "No matching records found."
-        headers = header_list
-        
-        # 2. 마크다운 표의 헤더와 구분선 생성
-        header_row = "| " + " | ".join(headers) + " |"
-        separator_row = "| " + " | ".join(["---"] * len(headers)) + " |"
-        
-        # 3. 데이터 행 생성
-        body_rows = []
-        for data in data_list:
-            if not isinstance(data, dict):
-                continue
+
+        # 2. 행 수를 미리 알므로 결과 리스트를 한 번에 할당 (append 재할당 제거)
+        join_cells = " | ".join
+        out = [None] * (2 + len(dict_rows))
+        out[0], out[1] = _header_rows(tuple(headers))
+
+        # 3. 데이터 행 생성 — 핫 루프이므로 조회를 지역 변수로 고정
+        nl_table = _NL_TABLE
+        for i, data in enumerate(dict_rows, 2):
             # 각 값을 문자열로 변환하고, 줄바꿈이 있다면 제거하여 표 깨짐 방지
             # 헤더의 값이 없으면, 빈 문자열로 채운다.
-            row_values = [str(data.get(h, "")).replace("\n", " ") for h in headers]
-            body_rows.append("| " + " | ".join(row_values) + " |")
-        
-        # 4. 전체 합치기
-        result_table = "\n".join([header_row, separator_row] + body_rows)
-        result_value = f"""
-        ### FHIR Resource: {resource_type}
-        The following table provides structured details for the **{resource_type}** resource.
-        {result_table}
-        """
-        
-        return result_value
+            get = data.get
+            out[i] = "| " + join_cells([str(get(h, "")).translate(nl_table) for h in headers]) + " |"
+
+        # 4. 전체 합치기 — 설명 envelope까지 같은 join에 넣어 표 전체 크기의
+        # 중간 문자열(f-string 삽입용)을 한 번 더 만들지 않음
+        out[0] = "        " + out[0]
+        return (
+            f"\n        ### FHIR Resource: {resource_type}\n"
+            f"        The following table provides structured details for the **{resource_type}** resource.\n"
+            + "\n".join(out)
+            + "\n        "
+        )
     
-    async def get_patient_observations(self, args: Dict[str, Any]):                
-        params = {            
-            '_sort': '-date',
-            '_count': '100'
-        }                
+    # -------------------------------------------------------------------------
+    # Endpoint 스펙 테이블 기반 조회
+    # -------------------------------------------------------------------------
+    # 각 get_patient_* 메서드는 "params 조립 -> GET -> 포맷터 -> 마크다운 표"의
+    # 동일한 골격이므로 스펙 테이블 + _fetch 하나로 수렴시킨다.
+    # 풀/세마포어/스트리밍/orjson 같은 공통 최적화가 전 endpoint에 자동 적용됨.
+    _ENDPOINTS: Dict[str, Dict[str, Any]] = {
+        "observations": {
+            "path": "/Observation",
+            "formatter": helper.format_recent_health_metrics,
+            "arg_map": (("patientId", "patient"), ("category", "category"),
+                        ("encounter_id", "encounter"), ("code", "code"),
+                        ("status", "status")),
+            "base_params": _OBSERVATION_LIST_PARAMS,
+            "date_range": True,
+            "stream": True,
+            "elements": "status,code,category,valueQuantity,effectiveDateTime,effectivePeriod,subject,encounter,performer",
+        },
+        "conditions": {
+            "path": "/Condition",
+            "formatter": helper.format_conditions,
+            "arg_map": (("patientId", "patient"), ("encounter_id", "encounter"),
+                        ("status", "clinical-status"), ("onsetDate", "onset-date")),
+            "stream": True,
+            "elements": "clinicalStatus,code,category,onsetDateTime,recordedDate,subject,encounter,recorder,asserter",
+        },
+        "medication_requests": {
+            "path": "/MedicationRequest",
+            "formatter": helper.format_medication_requests,
+            "arg_map": (("patientId", "patient"), ("encounter_id", "encounter"),
+                        ("status", "status")),
+            "medication_info": True,
+            "elements": "status,intent,identifier,authoredOn,medicationCodeableConcept,medicationReference,dosageInstruction,dispenseRequest,subject,encounter,requester,recorder,performer",
+        },
+        "medication_dispenses": {
+            "path": "/MedicationDispense",
+            "formatter": helper.format_medication_dispenses,
+            "arg_map": (("patientId", "patient"), ("encounter_id", "encounter"),
+                        ("status", "status")),
+            "medication_info": True,
+            "elements": "status,medicationCodeableConcept,medicationReference,dosageInstruction,subject,context,performer,authorizingPrescription",
+        },
+        "medication_administrations": {
+            "path": "/MedicationAdministration",
+            "formatter": helper.format_medication_administrations,
+            "arg_map": (("patientId", "patient"), ("encounter_id", "encounter"),
+                        ("status", "status")),
+            "medication_info": True,
+            "elements": "status,category,medicationCodeableConcept,medicationReference,dosage,effectiveDateTime,effectivePeriod,subject,context,performer,request",
+        },
+        "encounters": {
+            "path": "/Encounter",
+            "formatter": helper.format_encounters,
+            "arg_map": (("patientId", "patient"), ("status", "status")),
+            "date_range": True,
+            "elements": "status,class,type,period,reasonCode,subject,participant,serviceProvider,location",
+        },
+        "procedures": {
+            "path": "/Procedure",
+            "formatter": helper.format_procedures,
+            "arg_map": (("patientId", "patient"), ("encounter_id", "encounter"),
+                        ("status", "status")),
+            "date_range": True,
+            "elements": "status,code,category,performedDateTime,performedPeriod,subject,encounter,performer,recorder,asserter",
+        },
+        "medication_statements": {
+            "path": "/MedicationStatement",
+            "formatter": helper.format_medication_statement,
+            "arg_map": (("patientId", "patient"),),
+            "medication_info": True,
+            "elements": "status,medicationCodeableConcept,medicationReference,dosage,effectivePeriod,subject,context,informationSource,basedOn,partOf",
+        },
+        "diagnostic_reports": {
+            "path": "/DiagnosticReport",
+            "formatter": helper.format_diagnostic_reports,
+            "arg_map": (("patientId", "patient"),),
+            "elements": "status,category,code,issued,conclusion,subject,encounter,performer,result,basedOn",
+        },
+        "document_references": {
+            "path": "/DocumentReference",
+            "formatter": helper.format_document_references,
+            "arg_map": (("patientId", "patient"),),
+            "elements": "status,type,category,date,description,author,content,subject,context,authenticator,custodian",
+        },
+        "allergy_intolerances": {
+            "path": "/AllergyIntolerance",
+            "formatter": helper.format_allergy_intolerances,
+            "arg_map": (("patientId", "patient"),),
+            "elements": "clinicalStatus,verificationStatus,type,category,criticality,code,note,onsetDateTime,recordedDate,patient,encounter,recorder,asserter",
+        },
+        "family_member_history": {
+            "path": "/FamilyMemberHistory",
+            "formatter": helper.format_family_member_history,
+            "arg_map": (("patientId", "patient"),),
+            "elements": "status,relationship,sex,name,deceasedBoolean,condition,patient",
+        },
+        "immunizations": {
+            "path": "/Immunization",
+            "formatter": helper.format_immunizations,
+            "arg_map": (("patientId", "patient"), ("encounter_id", "encounter")),
+            "elements": "status,vaccineCode,occurrenceDateTime,protocolApplied,patient,encounter,performer,location",
+        },
+    }
+
+    async def _fetch(self, key: str, args: Dict[str, Any]) -> str:
+        spec = self._ENDPOINTS[key]
+        if args.get('patientId'):
+            args['patientId'] = await self.resolve_patient_id(args['patientId'])
+
         if args.get('id'):
-            params['_id'] = args['id']
+            params: Dict[str, Any] = {'_id': args['id']}
         else:
-            if args.get('patientId'): params['patient'] = str(args['patientId'])                            
-            if args.get('category'): params['category'] = args['category']
-            if args.get('encounter_id'): params['encounter'] = str(args['encounter_id'])
-            if args.get('code'): params['code'] = args['code']
-            if args.get('status'): params['status'] = args['status']
-            if args.get('dateFrom'): params.setdefault('date', []).append(f"ge{args['dateFrom']}")
-            if args.get('dateTo'): params.setdefault('date', []).append(f"le{args['dateTo']}")
-            
-        response = await self.client.get("/Observation", params=params)
-        # Observation은 종류가 다양하므로 helper의 recent metrics 사용
-        formatted_result = helper.format_recent_health_metrics(response.json())
-        md_text = self._dicts_to_markdown_table(formatted_result, resource_type='Observation')
-        return md_text
+            base = spec.get("base_params")
+            params = dict(base) if base else {}
+            for arg_key, fhir_key in spec["arg_map"]:
+                value = args.get(arg_key)
+                if value: params[fhir_key] = str(value)
+            if spec.get("date_range"):
+                self._apply_date_range(params, args)
 
-    async def get_patient_conditions(self, args: Dict[str, Any]):
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
+        # 포맷터가 읽는 element만 서버에서 projection (_elements) — narrative/extension을
+        # 전송·파싱하지 않음. 참조 필드는 Ref_* 추출을 위해 목록에 포함되어 있음
+        elements = spec.get("elements")
+        if elements:
+            params['_elements'] = elements
+
+        path = spec["path"]
+        formatter = spec["formatter"]
+        if spec.get("stream") and '_id' not in params:
+            # 목록 조회는 bundle이 커질 수 있으므로 entry 단위 스트리밍 파싱
+            data = await self._stream_entries(path, params)
+            formatted = formatter(data)
         else:
-            if args.get('patientId'): params['patient'] = str(args['patientId'])                            
-            if args.get('encounter_id'): params['encounter'] = str(args['encounter_id'])
-            if args.get('status'): params['clinical-status'] = args['status']
-            if args.get('onsetDate'): params['onset-date'] = args['onsetDate']
+            # 서버 기본 페이지가 작아도 link[next]를 따라 상한까지 이어서 수집
+            # (대용량 파싱은 _get_json이 워커 스레드로 오프로드함)
+            entries = [e async for e in self._iter_search(path, params, max_entries=_SEARCH_PAGE_LIMIT)]
+            formatted = formatter({'entry': entries})
+        if spec.get("medication_info"):
+            formatted = await self._get_medication_info(formatted)
+        return self._dicts_to_markdown_table(formatted, resource_type=path[1:])
+
+    async def get_patient_observations(self, args: Dict[str, Any]):
+        return await self._fetch("observations", args)
 
-        response = await self.client.get("/Condition", params=params)
-        formatted_result = helper.format_conditions(response.json())
-        md_text = self._dicts_to_markdown_table(formatted_result, resource_type='Condition')
-        return md_text
+    async def get_patient_conditions(self, args: Dict[str, Any]):
+        return await self._fetch("conditions", args)
 
     async def _get_medication_info(self, input: list[Dict[str, Any]]):
-        result_value = copy.deepcopy(input)
-        current_medications = [current_result.get('medication', '') for current_result in input if current_result.get('medication', '')]
+        # top-level 'medication' 키만 재할당하므로 행 단위 얕은 복사로 충분
+        # (deepcopy는 중첩 노드 전체를 재귀 복사해 행 수 대비 수십 배 비쌈)
+        result_value = [dict(row) if isinstance(row, dict) else row for row in input]
         #if Medication is retrieved as reference number, get Medication info
-        for index, current_medication in enumerate(current_medications):
-            if current_medication.startswith('Medication/'):
-                med_id = current_medication.split('/')[1]
-                response = await self.client.get(f"/{MEDICATION_INFO_RESOURCE}/{med_id}")
-                current_medication_info = helper.format_medication_info(response.json())
-                result_value[index]['medication'] = current_medication_info  
-        return result_value        
-        
-    #for medication request
+        pairs = []  # (행 index, Medication id)
+        for index, current_result in enumerate(input):
+            current_medication = current_result.get('medication', '')
+            if isinstance(current_medication, str) and current_medication.startswith('Medication/'):
+                pairs.append((index, current_medication.split('/')[1]))
+        if not pairs:
+            return result_value
+
+        # 같은 Medication 참조가 여러 행에 반복되므로 id로 중복 제거하고,
+        # 캐시에 없는 것만 실제로 조회 (순서 보존 dedupe: dict.fromkeys)
+        med_cache = self._med_cache
+        missing = [mid for mid in dict.fromkeys(mid for _, mid in pairs) if mid not in med_cache]
+        if missing:
+            fetched: Dict[str, str] = {}
+            # FHIR _id 조합 검색(_id=a,b,c)으로 N건을 한 번의 왕복으로 조회
+            try:
+                response = await self._get(
+                    f"/{MEDICATION_INFO_RESOURCE}",
+                    params={'_id': ','.join(missing), '_count': str(len(missing))}
+                )
+                response.raise_for_status()
+                for entry in self._decode(response).get('entry', []):
+                    res = entry.get('resource', {})
+                    if res.get('id'):
+                        fetched[res['id']] = helper.format_medication_info(res)
+            except httpx.HTTPError:
+                pass  # 조합 검색 미지원 서버: 아래 개별 GET 폴백으로 처리
+            # 조합 검색이 실패했거나 일부 id가 응답에 빠진 경우 개별 GET (동시 실행)
+            leftover = [mid for mid in missing if mid not in fetched]
+            if leftover:
+                responses = await asyncio.gather(
+                    *(self._get(f"/{MEDICATION_INFO_RESOURCE}/{mid}") for mid in leftover)
+                )
+                for mid, response in zip(leftover, responses):
+                    fetched[mid] = helper.format_medication_info(self._decode(response))
+            for mid, info in fetched.items():
+                med_cache[mid] = info
+                if len(med_cache) > _MED_CACHE_MAX:
+                    med_cache.popitem(last=False)
+        for index, mid in pairs:
+            info = med_cache.get(mid)
+            if info is not None:
+                med_cache.move_to_end(mid)
+                result_value[index]['medication'] = info
+        return result_value
+
     async def get_patient_medication_requests(self, args: Dict[str, Any]):
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            if args.get('patientId'): params['patient'] = str(args['patientId'])                            
-            if args.get('encounter_id'): params['encounter'] = str(args['encounter_id'])
-            if args.get('status'): params['status'] = args['status']
-        
-        response = await self.client.get(f"/MedicationRequest", params=params)
-        
-        format_result = helper.format_medication_requests(response.json()) #adding medication name or reference info
-        result_list = await self._get_medication_info(format_result)
-        
-        md_text = self._dicts_to_markdown_table(result_list, resource_type='MedicationRequest')
-        
-        return md_text
-    
+        return await self._fetch("medication_requests", args)
+
     async def get_patient_medication_dispenses(self, args: Dict[str, Any]):
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            if args.get('patientId'): params['patient'] = str(args['patientId'])                            
-            if args.get('encounter_id'): params['encounter'] = str(args['encounter_id'])
-            if args.get('status'): params['status'] = args['status']
-        
-        response = await self.client.get(f"/MedicationDispense", params=params)
-        
-        format_result = helper.format_medication_dispenses(response.json()) #adding medication name or reference info
-        result_list = await self._get_medication_info(format_result)
-        
-        md_text = self._dicts_to_markdown_table(result_list, resource_type='MedicationDispense')
-        
-        return md_text
+        return await self._fetch("medication_dispenses", args)
 
     async def get_patient_medication_administrations(self, args: Dict[str, Any]):
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            if args.get('patientId'): params['patient'] = str(args['patientId'])                            
-            if args.get('encounter_id'): params['encounter'] = str(args['encounter_id'])
-            if args.get('status'): params['status'] = args['status']
-        
-        response = await self.client.get(f"/MedicationAdministration", params=params)
-        
-        formatted_list = helper.format_medication_administrations(response.json()) #adding medication name or reference info
-        result_list = await self._get_medication_info(formatted_list)
-        
-        md_text = self._dicts_to_markdown_table(result_list, resource_type='MedicationAdministration')
-        
-        return md_text
-    
+        return await self._fetch("medication_administrations", args)
 
     async def get_patient_encounters(self, args: Dict[str, Any]):
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            if args.get('patientId'): params['patient'] = args['patientId']
-            if args.get('status'): params['status'] = args['status']
-            if args.get('dateFrom'): params.setdefault('date', []).append(f"ge{args['dateFrom']}")
-            if args.get('dateTo'): params.setdefault('date', []).append(f"le{args['dateTo']}")
-
-        response = await self.client.get("/Encounter", params=params)
-        formatted_result = helper.format_encounters(response.json())
-        mk_table = self._dicts_to_markdown_table(formatted_result, resource_type='Encounter')
-        return mk_table
-
+        return await self._fetch("encounters", args)
 
     async def get_patient_procedures(self, args: Dict[str, Any]):
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            if args.get('patientId'): params['patient'] = str(args['patientId'])                            
-            if args.get('encounter_id'): params['encounter'] = str(args['encounter_id'])                    
-            if args.get('status'): params['status'] = args['status']
-            if args.get('dateFrom'): params.setdefault('date', []).append(f"ge{args['dateFrom']}")
-            if args.get('dateTo'): params.setdefault('date', []).append(f"le{args['dateTo']}")
-
-        response = await self.client.get("/Procedure", params=params)
-        format_result = helper.format_procedures(response.json())
-        md_text = self._dicts_to_markdown_table(format_result, resource_type='Procedure')
-        return md_text
-
+        return await self._fetch("procedures", args)
 
     async def get_medication_history(self, args: Dict[str, Any]):
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            params = {'patient': str(args['patientId'])}
-        
-        response = await self.client.get("/MedicationStatement", params=params)        
-        formatted_list = helper.format_medication_statement(response.json())
-        result_list = await self._get_medication_info(formatted_list)
-        
-        md_text = self._dicts_to_markdown_table(result_list, resource_type='MedicationStatement')
-        
-        return md_text
-    
-    
+        return await self._fetch("medication_statements", args)
+
     async def get_diagnostic_reports(self, args: Dict[str, Any])->str:
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            params = {'patient': str(args['patientId'])}
-        
-        response = await self.client.get("/DiagnosticReport", params=params)        
-        formatted_list = helper.format_diagnostic_reports(response.json())
-        
-        md_text = self._dicts_to_markdown_table(formatted_list, resource_type='DiagnosticReport')
-        
-        return md_text
-    
+        return await self._fetch("diagnostic_reports", args)
+
     async def get_document_references(self, args: Dict[str, Any])->str:
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            params = {'patient': str(args['patientId'])}
-        
-        response = await self.client.get("/DocumentReference", params=params)        
-        formatted_list = helper.format_document_references(response.json())
-        
-        md_text = self._dicts_to_markdown_table(formatted_list, resource_type='DocumentReference')
-        
-        return md_text
-    
+        return await self._fetch("document_references", args)
+
     async def get_allergy_intolerances(self, args: Dict[str, Any])->str:
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            params = {'patient': str(args['patientId'])}
-        
-        response = await self.client.get("/AllergyIntolerance", params=params)        
-        formatted_list = helper.format_allergy_intolerances(response.json())
-        
-        md_text = self._dicts_to_markdown_table(formatted_list, resource_type='AllergyIntolerance')
-        
-        return md_text
-    
+        return await self._fetch("allergy_intolerances", args)
+
     async def get_family_member_history(self, args: Dict[str, Any])->str:
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            params = {'patient': str(args['patientId'])}
-        
-        response = await self.client.get("/FamilyMemberHistory", params=params)        
-        formatted_list = helper.format_family_member_history(response.json())
-        
-        md_text = self._dicts_to_markdown_table(formatted_list, resource_type='FamilyMemberHistory')
-        
-        return md_text
-    
+        return await self._fetch("family_member_history", args)
+
     async def get_patient_immunizations(self, args: Dict[str, Any])->str:
-        params = {}
-        if args.get('id'):
-            params['_id'] = args['id']        
-        else:
-            if args.get('patientId'): params['patient'] = str(args['patientId'])                            
-            if args.get('encounter_id'): params['encounter'] = str(args['encounter_id'])    
-        
-        response = await self.client.get("/Immunization", params=params)        
-        formatted_list = helper.format_immunizations(response.json())
-        
-        md_text = self._dicts_to_markdown_table(formatted_list, resource_type='Immunization')
-        
-        return md_text
\ No newline at end of file
+        return await self._fetch("immunizations", args)
+
+    async def get_patient_bundle(self, args: Dict[str, Any], resources: List[str]) -> Dict[str, str]:
+        """
+        한 환자에 대한 여러 endpoint 조회를 동시에 실행합니다.
+        각 조회는 독립적인 FHIR 검색이므로 순차 await 대신 gather로 묶으면
+        전체 소요 시간이 합이 아니라 가장 느린 조회 하나 수준이 됩니다.
+
+        Args:
+            args: get_patient_* 와 동일한 인자 (patientId 등)
+            resources: _ENDPOINTS 키 리스트 (예: ["observations", "conditions"])
+
+        Returns:
+            {endpoint 키: 포맷된 결과} — 입력 resources 순서 보존
+        """
+        # patientId 해석을 먼저 한 번만 수행 (각 _fetch에서 중복 조회 방지 — 캐시가 있지만
+        # 첫 해석이 동시에 N번 나가는 것을 막음)
+        if args.get('patientId'):
+            args = dict(args)
+            args['patientId'] = await self.resolve_patient_id(args['patientId'])
+        results = await asyncio.gather(*(self._fetch(key, args) for key in resources))
+        return dict(zip(resources, results))
@@ -1,13 +1,14 @@
-import re
 from datetime import datetime
+from functools import lru_cache
 from typing import Any, List, Dict, Optional, Union
 
-TARGET_FHIR_RESOURCES = [
+# reference 노드마다 membership 검사를 하므로 O(1) 해시 조회가 되도록 frozenset
+TARGET_FHIR_RESOURCES = frozenset({
     "Patient",
     "Encounter",
-    "Observation",        
+    "Observation",
     "Condition",
-    "Procedure",    
+    "Procedure",
     "MedicationRequest",
     "MedicationDispense",
     "MedicationAdministration",
@@ -17,84 +18,146 @@ TARGET_FHIR_RESOURCES = [
     "AllergyIntolerance",
     "FamilyMemberHistory",
     "Immunization"
-]
+})
 
-def convert_fhir_to_local_str(fhir_time_str: str) -> str:
+# get-chain 기본값으로 재사용하는 불변 상수 (행마다 {} / [{}] 리터럴 할당 제거)
+_EMPTY: Dict[str, Any] = {}
+_EMPTY_LIST = ({},)
+
+# 월별 말일 테이블 (윤년 무시 — calculate_timeframe_date의 단순화와 동일)
+_MDAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# resourceType별 Ref_* 키는 고정이므로 참조마다 f-string을 새로 만들지 않고 조회
+_REF_DISPLAY_KEY = {r: f"Ref_Display_{r}" for r in TARGET_FHIR_RESOURCES}
+_REF_ID_KEY = {r: f"Ref_ID_{r}" for r in TARGET_FHIR_RESOURCES}
+
+def _phone_of(telecoms) -> str:
+    """telecom 목록에서 phone 값을 찾습니다 (C 레벨 next/generator로 스캔)."""
+    return next((t.get('value', 'Not provided') for t in telecoms
+                 if t.get('system') == 'phone'), 'Not provided')
+
+def _telecom_map(resource: Dict[str, Any]) -> Dict[str, str]:
+    """telecom 목록을 {system: value}로 1-pass 변환합니다.
+
+    phone/email/fax를 함께 쓰는 호출자가 목록을 system마다 재스캔하지 않도록
+    한 번만 걷고, 같은 system이 여러 개면 FHIR 목록 순서상 첫 값을 유지합니다.
     """
-    FHIR 날짜/시간을 입력받아 현재 로컬 타임존 기준으로 변환하여 출력합니다.
-    - 'T' 포함 시: 로컬 타임존으로 변환 후 YYYY-MM-DD HH:MM:SS
-    - 'T' 미포함 시: YYYY-MM-DD (날짜만 출력)
+    systems: Dict[str, str] = {}
+    set_default = systems.setdefault
+    for t in resource.get('telecom') or ():
+        s = t.get('system')
+        if s is not None:
+            set_default(s, t.get('value', 'Not provided'))
+    return systems
+
+def _first_coding(resource: Dict[str, Any], key: str = 'code') -> Dict[str, Any]:
+    """resource[key].coding[0]을 기본값 리터럴 할당 없이 안전하게 꺼냅니다."""
+    c = resource.get(key)
+    if not c:
+        return _EMPTY
+    coding = c.get('coding')
+    return coding[0] if coding else _EMPTY
+
+def _medication_name(med: Dict[str, Any]) -> str:
+    """medicationCodeableConcept → medicationReference 순의 공통 fallback 체인.
+
+    네 군데 medication 포맷터가 같은 4단 체인을 반복하던 것을 한 번의
+    coding[0] 조회로 합쳐 'Unknown Medication' 비교 3회를 제거합니다.
     """
-    # 1. 안전한 입력을 위한 유효성 검사
-    if not isinstance(fhir_time_str, str) or "-" not in fhir_time_str:
-        return fhir_time_str
-
+    c = _first_coding(med, 'medicationCodeableConcept')
+    ref = med.get('medicationReference') or _EMPTY
+    return (c.get('display') or c.get('code')
+            or ref.get('display') or ref.get('reference')
+            or 'Unknown Medication')
+
+# astimezone()이 호출마다 로컬 타임존을 다시 계산하지 않도록 한 번만 조회해 재사용
+_LOCAL_TZ = datetime.now().astimezone().tzinfo
+
+@lru_cache(maxsize=4096)
+def _convert_fhir_cached(fhir_time_str: str) -> str:
+    # 실제 파싱/변환 본체 — 같은 timestamp가 bundle 안에서 반복되므로 memoize
     try:
         if "T" in fhir_time_str:
             # 2. DateTime 처리: ISO 8601 파싱 (타임존 정보 포함)
             dt_obj = datetime.fromisoformat(fhir_time_str)
-            
-            # 3. 로컬 타임존으로 변환 (astimezone에 인자 없으면 시스템 설정 기준)
-            local_dt = dt_obj.astimezone()
-            
+
+            # 3. 로컬 타임존으로 변환 — naive면 이미 로컬 기준이므로 변환 생략
+            local_dt = dt_obj if dt_obj.tzinfo is None else dt_obj.astimezone(_LOCAL_TZ)
+
             return local_dt.strftime("%Y-%m-%d %H:%M:%S")
         
         else:
-            # 4. Date 처리 (T가 없는 경우): 날짜만 파싱하여 형식 통일
-            # FHIR date는 보통 'YYYY-MM-DD' 형식이므로 문자열 슬라이싱만으로도 충분합니다.
-            dt_obj = datetime.strptime(fhir_time_str[:10], "%Y-%m-%d")
-            return dt_obj.strftime("%Y-%m-%d")
+            # 4. Date 처리 (T가 없는 경우): 출력이 곧 앞 10글자이므로 슬라이스만 하고,
+            # fromisoformat 호출은 형식 검증용으로만 사용 (strptime 포맷 해석기 제거)
+            date_str = fhir_time_str[:10]
+            datetime.fromisoformat(date_str)
+            return date_str
 
     except ValueError:
         return fhir_time_str
 
+def convert_fhir_to_local_str(fhir_time_str: str) -> str:
+    """
+    FHIR 날짜/시간을 입력받아 현재 로컬 타임존 기준으로 변환하여 출력합니다.
+    - 'T' 포함 시: 로컬 타임존으로 변환 후 YYYY-MM-DD HH:MM:SS
+    - 'T' 미포함 시: YYYY-MM-DD (날짜만 출력)
+    """
+    # 1. 안전한 입력을 위한 유효성 검사 (비문자열은 캐시 키로 쓰지 않고 즉시 반환)
+    if not isinstance(fhir_time_str, str) or "-" not in fhir_time_str:
+        return fhir_time_str
+    return _convert_fhir_cached(fhir_time_str)
+
 def extract_ref_display(data):
+    # 재귀 대신 명시적 스택 순회 — 노드마다 함수 프레임을 만들지 않고,
+    # 깊은 resource에서도 재귀 한도에 걸리지 않음. (역순으로 쌓아 기존
+    # 재귀의 전위(preorder) 방문 순서를 그대로 유지)
     results = []
-
-    # 1. 데이터가 딕셔너리인 경우
-    if isinstance(data, dict):
-        # 원하는 키("reference")가 있는지 확인: tool 로 제작한 FHIR resource 만 해당
-        if "reference" in data :
-            reference_split = data["reference"].split("/")
-            if len(reference_split) == 2:                
-                resource_type = data["reference"].split("/")[0]
-                if resource_type in TARGET_FHIR_RESOURCES:
-                    current_result = {
-                        "display": data.get("display", ""),
-                        "resourceType": resource_type,
-                        "id": data["reference"].split("/")[1]
-                    }                   
-                    results.append(current_result)
-        
-        # 딕셔너리의 내부 값들 중 또 다른 딕셔너리나 리스트가 있을 수 있으므로 재귀 호출
-        for value in data.values():
-            results.extend(extract_ref_display(value))
-
-    # 2. 데이터가 리스트인 경우
-    elif isinstance(data, list):
-        # 리스트의 각 아이템에 대해 다시 함수 호출 (재귀)
-        for item in data:
-            results.extend(extract_ref_display(item))
+    append = results.append
+    stack = [data]
+    pop = stack.pop
+    while stack:
+        current = pop()
+        # 1. 데이터가 딕셔너리인 경우
+        if isinstance(current, dict):
+            # 원하는 키("reference")가 있는지 확인: tool 로 제작한 FHIR resource 만 해당
+            ref = current.get("reference")
+            if ref is not None:
+                # "Type/id" 꼴 검사: split의 리스트 할당 없이 find 2회 + 슬라이스 2회
+                slash = ref.find("/")
+                if slash > 0 and ref.find("/", slash + 1) == -1:
+                    resource_type = ref[:slash]
+                    if resource_type in TARGET_FHIR_RESOURCES:
+                        append({
+                            "display": current.get("display", ""),
+                            "resourceType": resource_type,
+                            "id": ref[slash + 1:]
+                        })
+            # 딕셔너리의 내부 값들 중 또 다른 딕셔너리나 리스트가 있을 수 있음
+            stack.extend(reversed(list(current.values())))
+        # 2. 데이터가 리스트인 경우
+        elif isinstance(current, list):
+            stack.extend(reversed(current))
 
     return results
 
-def apply_reference_info(item: Dict[str, Any], reference_result: List[Dict[str, Any]]) -> None:    
+def apply_reference_info(item: Dict[str, Any], reference_result: List[Dict[str, Any]]) -> None:
+    # 참조마다 isinstance 검사 + 리스트 승격을 반복하는 대신, 일단 리스트로만
+    # 모은 뒤 마지막에 단일 값은 풀어서 기존 출력 형태(스칼라 또는 리스트)를 유지
+    acc: Dict[str, List[Any]] = {}
+    set_default = acc.setdefault
     for current_reference in reference_result:
-        current_display_key = f"Ref_Display_{current_reference['resourceType']}"
-        if current_display_key in item:            
-            if not isinstance(item[current_display_key], list):                
-                item[current_display_key] = [item[current_display_key]]            
-            item[current_display_key].append(current_reference['display'])
-        else:                
-            item[current_display_key] = current_reference['display']
-        
-        current_id_key = f"Ref_ID_{current_reference['resourceType']}"
-        if current_id_key in item:            
-            if not isinstance(item[current_id_key], list):                
-                item[current_id_key] = [item[current_id_key]]            
-            item[current_id_key].append(current_reference['id'])
-        else:                
-            item[current_id_key] = current_reference['id']
+        resource_type = current_reference['resourceType']
+        set_default(_REF_DISPLAY_KEY[resource_type], []).append(current_reference['display'])
+        set_default(_REF_ID_KEY[resource_type], []).append(current_reference['id'])
+
+    for key, values in acc.items():
+        existing = item.get(key)
+        if existing is None:
+            item[key] = values[0] if len(values) == 1 else values
+        elif isinstance(existing, list):
+            existing.extend(values)
+        else:
+            item[key] = [existing, *values]
         
 # Enhanced Helper Functions
 def get_reference_info(resource: Dict[str, Any]) -> Dict[str, Any]:
@@ -110,36 +173,33 @@ def format_patient_search_results(bundle: Dict[str, Any], params: Optional[Dict[
     if not entries:
         return results
 
+    # 필터 기준은 루프 내내 불변이므로 lower()를 entry마다 다시 돌리지 않는다
+    want_last = params['lastName'].lower() if params and params.get('lastName') else None
+    want_first = params['firstName'].lower() if params and params.get('firstName') else None
+    # want_gender = params['gender'].lower() if params and params.get('gender') not in (None, '', 'unknown') else None
+
     for entry in entries:
-        patient = entry.get('resource', {})
-        name_list = patient.get('name', [{}])
+        patient = (entry.get('resource') or _EMPTY)
+        name_list = (patient.get('name') or _EMPTY_LIST)
         name = name_list[0] if name_list else {}
-        
-        address_list = patient.get('address', [{}])
+
+        # 필터에 필요한 name 필드만 먼저 보고, 탈락 entry는 주소/전화 조립 전에 건너뜀
+        if want_last and name.get('family', '').lower() != want_last:
+            continue
+        given_name = ' '.join(name.get('given', []))
+        if want_first and given_name.lower() != want_first:
+            continue
+        # if want_gender and patient.get('gender') and patient.get('gender').lower() != want_gender:
+        #     continue
+
+        address_list = (patient.get('address') or _EMPTY_LIST)
         address = address_list[0] if address_list else {}
 
-        # Phone formatting
-        telecoms = patient.get('telecom', [])
-        phone = 'Not provided'
-        for t in telecoms:
-            if t.get('system') == 'phone':
-                phone = t.get('value', 'Not provided')
-                break
+        # Phone formatting — 빈 튜플 기본값으로 [] 할당도 피함
+        phone = _phone_of(patient.get('telecom') or ())
 
-        given_name = ' '.join(name.get('given', []))
-        
-        if params is not None:
-            if params.get('lastName'): 
-                if name.get('family', '').lower() != params['lastName'].lower():
-                    continue
-            if params.get('firstName'):
-                if given_name.lower() != params['firstName'].lower():
-                    continue
-            # if params.get('gender') and params.get('gender') != 'unknown' and patient.get('gender'):
-            #     if patient.get('gender').lower() != params['gender'].lower():
-            #         continue
         lastUpdated = ''
-        lastUpdated_str = patient.get('meta', {}).get('lastUpdated', '')
+        lastUpdated_str = (patient.get('meta') or _EMPTY).get('lastUpdated', '')
         if lastUpdated_str != '':
             lastUpdated = convert_fhir_to_local_str(lastUpdated_str)
         
@@ -162,6 +222,51 @@ def format_patient_search_results(bundle: Dict[str, Any], params: Optional[Dict[
 
 
 
+def format_patient_summary(data: Dict[str, Any]) -> str:
+    """
+    환자 인적사항 + 주요 리소스 섹션을 하나의 요약 문자열로 만듭니다
+    (prompter의 care-gaps/리스크 계열 프롬프트에서 사용).
+    섹션별 문자열을 f-string으로 재결합하지 않고 줄 리스트에 모아 join 한 번으로 조립.
+    """
+    patient = data.get('patient') or _EMPTY
+    name_list = patient.get('name') or _EMPTY_LIST
+    name = name_list[0]
+    given_name = ' '.join(name.get('given') or ())
+    address_list = patient.get('address') or _EMPTY_LIST
+    birth_date = patient.get('birthDate', '')
+
+    # phone/email을 한 번의 telecom 순회로 모두 얻음
+    systems = _telecom_map(patient)
+    lines = [
+        f"      - Name: {name.get('family', '')}, {given_name}",
+        f"      - DOB: {birth_date or 'Unknown'}",
+        f"      - Age: {calculate_age(birth_date)}",
+        f"      - Gender: {patient.get('gender', 'Unknown')}",
+        f"      - Address: {format_address(address_list[0])}",
+        f"      - Phone: {systems.get('phone', 'Not provided')}",
+    ]
+    if 'email' in systems:
+        lines.append(f"      - Email: {systems['email']}")
+
+    sections = (
+        ('Conditions', format_conditions(data.get('conditions') or {})),
+        ('Medications', format_medication_requests(data.get('medications') or {})),
+        ('Allergies', format_allergy_intolerances(data.get('allergies') or {})),
+        ('Immunizations', format_immunizations(data.get('immunizations') or {})),
+        ('Procedures', format_procedures(data.get('procedures') or {})),
+        ('Encounters', format_encounters(data.get('encounters') or {})),
+    )
+    append = lines.append
+    for title, rows in sections:
+        if not rows:
+            continue  # 비어 있는 섹션은 프롬프트에서 제외
+        append(f"      - {title}:")
+        for row in rows:
+            append(f"        {row}")
+
+    return '\n'.join(lines)
+
+
 def format_procedures(bundle: Dict[str, Any]):
     output = []
     
@@ -170,9 +275,9 @@ def format_procedures(bundle: Dict[str, Any]):
         return output
 
     for entry in entries:
-        procedure = entry.get('resource', {})
-        proc_display = procedure.get('code', {}).get('coding', [{}])[0].get('display') or 'Unknown procedure'
-        category = procedure.get('category', {}).get('coding', [{}])[0].get('code') or 'Unknown category'
+        procedure = (entry.get('resource') or _EMPTY)
+        proc_display = _first_coding(procedure).get('display') or 'Unknown procedure'
+        category = _first_coding(procedure, 'category').get('code') or 'Unknown category'
         Status = procedure.get('status') or 'unknown status'
         period = procedure.get('performedPeriod')
         period_str = 'unknown'
@@ -201,7 +306,7 @@ def format_encounters(bundle: Dict[str, Any]):
         return output
 
     for entry in entries:
-        encounter = entry.get('resource', {})
+        encounter = (entry.get('resource') or _EMPTY)
         period_str = 'unknown period'
         if 'period' in encounter:
             start = convert_fhir_to_local_str(encounter['period'].get('start', ''))
@@ -209,13 +314,16 @@ def format_encounters(bundle: Dict[str, Any]):
             period_str = f"{start} to {end}"
         
         #"start"와 "end" 를 period로 정리해서 출력
-        type_list = encounter.get('type', [{}])
-        type_display = type_list[0].get('coding', [{}])[0].get('display') if type_list else 'Unknown encounter type'
-        class_display = encounter.get('class', {}).get('code', '')
-        reason_list = encounter.get('reasonCode', [{}])
+        type_list = encounter.get('type')
+        type_display = ((type_list[0].get('coding') or _EMPTY_LIST)[0].get('display')
+                        if type_list else 'Unknown encounter type')
+        class_display = (encounter.get('class') or _EMPTY).get('code', '')
+        reason_list = encounter.get('reasonCode')
         reason_display = 'Unknown reason for encounter'
         if reason_list:
-            reason_display = reason_list[0].get('coding', [{}])[0].get('display') or reason_list[0].get('text') or reason_display
+            reason0 = reason_list[0]
+            reason_display = ((reason0.get('coding') or _EMPTY_LIST)[0].get('display')
+                              or reason0.get('text') or reason_display)
         
         reference_result = extract_ref_display(encounter)
         
@@ -241,84 +349,104 @@ def format_encounters(bundle: Dict[str, Any]):
 
 
 
+@lru_cache(maxsize=1024)
+def _format_address_parts(line_str: Optional[str], city: Optional[str],
+                          state: Optional[str], postal_code: Optional[str]) -> str:
+    # Filter Boolean equivalent in Python (removes None/Empty strings)
+    return ', '.join(p for p in (line_str, city, state, postal_code) if p)
+
+
 def format_address(address: Dict[str, Any]) -> str:
     if not address:
         return 'Not provided'
-    
+
     lines = address.get('line', [])
     line_str = ' '.join(lines) if lines else None
-    
-    parts = [
-        line_str,
-        address.get('city'),
-        address.get('state'),
-        address.get('postalCode')
-    ]
-    
-    # Filter Boolean equivalent in Python (removes None/Empty strings)
-    filtered_parts = [p for p in parts if p]
-    
-    return ', '.join(filtered_parts)
+
+    # dict는 해시 불가이므로 leaf 값 튜플을 키로 memoize — 같은 주소가
+    # 반복되는 목록에서 filter+join을 캐시 조회로 대체
+    return _format_address_parts(
+        line_str, address.get('city'), address.get('state'), address.get('postalCode')
+    )
 
 
 # Utility functions
 
+def calculate_age(birth_date_str: str, today: Optional[datetime] = None) -> int:
+    """birthDate('YYYY-MM-DD')로 만 나이를 계산합니다. 형식이 깨진 값은 0.
+
+    배치 호출자는 today를 한 번만 구해 넘겨 datetime.now() 시스템 콜을 줄일 수 있습니다.
+    """
+    # 고정 ISO 형식이므로 strptime의 포맷 해석기 대신 슬라이스 + int 변환으로 파싱
+    if not birth_date_str or len(birth_date_str) < 10:
+        return 0
+    try:
+        y = int(birth_date_str[0:4])
+        m = int(birth_date_str[5:7])
+        d = int(birth_date_str[8:10])
+    except ValueError:
+        return 0
+    if today is None:
+        today = datetime.now()
+    # 생일이 아직 안 지났으면 bool 산술로 1 빼기 (분기 없이)
+    return today.year - y - ((today.month, today.day) < (m, d))
+
+
 def calculate_timeframe_date(timeframe: str) -> Optional[str]:
-    match = re.match(r"^(\d+)([my])$", timeframe)
-    if not match:
+    # "6m"/"2y" 꼴은 정규식 없이 slice+isdigit으로 충분 (regex 엔진 진입 비용 제거)
+    if not timeframe:
+        return None
+    unit = timeframe[-1]
+    num_str = timeframe[:-1]
+    if unit not in ('m', 'y') or not num_str.isdigit():
         return None
 
-    value = int(match.group(1))
-    unit = match.group(2)
-    
+    value = int(num_str)
+
     today = datetime.now()
     target_date = today
 
     if unit == 'm':
-        # Simple month subtraction logic
-        year = today.year
-        month = today.month - value
-        while month <= 0:
-            year -= 1
-            month += 12
+        # Simple month subtraction logic — while 루프 대신 divmod 한 번으로 연도 보정
+        total = today.year * 12 + (today.month - 1) - value
+        year, month0 = divmod(total, 12)
+        month = month0 + 1
         # Handle day overflow (e.g. March 30 - 1 month = Feb 30 -> Feb 28)
-        # This is a simplification; for production code consider dateutil.relativedelta
-        day = today.day
-        if month == 2:
-            day = min(day, 28) # Leap year ignored for simplicity to match JS simple logic
-        elif month in [4, 6, 9, 11]:
-            day = min(day, 30)
-            
+        # 월별 말일 테이블 조회 — 분기 사다리 제거 (leap year ignored for simplicity
+        # to match JS simple logic; for production code consider dateutil.relativedelta)
+        day = min(today.day, _MDAYS[month0])
+
         target_date = datetime(year, month, day)
         
     elif unit == 'y':
         target_date = today.replace(year=today.year - value)
 
-    return target_date.isoformat().split('T')[0]
+    # isoformat 전체 문자열을 만들어 'T'로 쪼개는 대신 날짜 부분만 바로 포맷
+    return target_date.date().isoformat()
 
 
 
 
 
 def format_recent_health_metrics(bundle: Dict[str, Any]):
-    entries = bundle.get('entry', [])
+    entries = bundle.get('entry', []) if isinstance(bundle, dict) else bundle
     if not entries:
         return "No recent health metrics available"
 
     metrics: Dict[str, Dict[str, Any]] = {}
 
     for entry in entries:
-        obs = entry.get('resource', {})
-        obs_type = obs.get('code', {}).get('coding', [{}])[0].get('display') or 'Unknown'
-        obs_category = obs.get('category', [{}])[0].get('coding',[{}])[0].get('code') or 'Unknown'
+        obs = (entry.get('resource') or _EMPTY)
+        obs_type = _first_coding(obs).get('display') or 'Unknown'
+        obs_category = ((obs.get('category') or _EMPTY_LIST)[0].get('coding') or _EMPTY_LIST)[0].get('code') or 'Unknown'
         if obs_type not in metrics:
-            val_q = obs.get('valueQuantity', {})
+            val_q = (obs.get('valueQuantity') or _EMPTY)
             value_str = f"{val_q.get('value', 'No value')} {val_q.get('unit', '')}"
             date_str = "unknown"
             if obs.get('effectiveDateTime'):
                 date_str = convert_fhir_to_local_str(obs['effectiveDateTime'])
             elif obs.get('effectivePeriod'):
-                period = obs.get('effectivePeriod', {})
+                period = (obs.get('effectivePeriod') or _EMPTY)
                 if 'start' in period and 'end' in period:
                     start = convert_fhir_to_local_str(period.get('start'))
                     end = convert_fhir_to_local_str(period.get('end'))
@@ -360,10 +488,11 @@ def format_conditions(bundle: Dict[str, Any]):
         return lines
 
     for entry in entries:
-        condition = entry.get('resource', {})
-        coding = condition.get('code', {}).get('coding', [{}])[0]
-        name = coding.get('display') or condition.get('code', {}).get('text') or 'Unknown Condition'        
-        category = condition.get('category', [{}])[0].get('coding', [{}])[0].get('code') or 'Unknown Category'
+        condition = (entry.get('resource') or _EMPTY)
+        code = condition.get('code') or _EMPTY
+        coding = _first_coding(condition)
+        name = coding.get('display') or code.get('text') or 'Unknown Condition'
+        category = ((condition.get('category') or _EMPTY_LIST)[0].get('coding') or _EMPTY_LIST)[0].get('code') or 'Unknown Category'
         
         if condition.get('onsetDateTime'):
             onset_str = convert_fhir_to_local_str(condition['onsetDateTime'])            
@@ -371,7 +500,7 @@ def format_conditions(bundle: Dict[str, Any]):
             onset_str = convert_fhir_to_local_str(condition['recordedDate'])
         else:
             onset_str = 'unknown'    
-        status = condition.get('clinicalStatus', {}).get('coding', [{}])[0].get('code', '')
+        status = _first_coding(condition, 'clinicalStatus').get('code', '')
         if status == '':
             status = condition.get('status', 'unknown')
         reference_result = extract_ref_display(condition)    
@@ -396,8 +525,8 @@ def format_medication_requests(bundle: Dict[str, Any]) -> list:
 
     lines = []
     for entry in entries:
-        med = entry.get('resource', {})
-        identifier = med.get('identifier', [{}])
+        med = (entry.get('resource') or _EMPTY)
+        identifier = (med.get('identifier') or _EMPTY_LIST)
         identifier_txt = ''
         for contents in identifier:
             current_value = contents.get('value', '')
@@ -410,27 +539,21 @@ def format_medication_requests(bundle: Dict[str, Any]) -> list:
         if med.get('authoredOn'):
             dateOn = convert_fhir_to_local_str(med.get('authoredOn'))
                 
-        valid_start = med.get('dispenseRequest', {}).get('validityPeriod', {}).get('start', '')
-        valid_end = med.get('dispenseRequest', {}).get('validityPeriod', {}).get('end', '')
+        valid_start = ((med.get('dispenseRequest') or _EMPTY).get('validityPeriod') or _EMPTY).get('start', '')
+        valid_end = ((med.get('dispenseRequest') or _EMPTY).get('validityPeriod') or _EMPTY).get('end', '')
 
         valid_str = ''
         if valid_start != '' and valid_end != '':
             valid_str = f"{convert_fhir_to_local_str(valid_start)} to {convert_fhir_to_local_str(valid_end)}"
         
-        medication = med.get('medicationCodeableConcept', {}).get('coding', [{}])[0].get('display', {}) or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationCodeableConcept', {}).get('coding', [{}])[0].get('code', {}) or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationReference', {}).get('display') or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationReference', {}).get('reference') or 'Unknown Medication' 
+        medication = _medication_name(med)
         
-        dosage_instr = med.get('dosageInstruction', [{}])[0]
+        dosage_instr = (med.get('dosageInstruction') or _EMPTY_LIST)[0]
         dosage_text = dosage_instr.get('text', 'No dosage instructions')
-        dosage_timing = dosage_instr.get('timing', {}).get('code', {}).get('coding', [{}])[0].get('code', '')
+        dosage_timing = (((dosage_instr.get('timing') or _EMPTY).get('code') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code', '')
         
-        dose_quantity_value = dosage_instr.get('doseAndRate', [{}])[0].get('doseQuantity', {}).get('value', '')
-        dose_quantity_unit = dosage_instr.get('doseAndRate', [{}])[0].get('doseQuantity', {}).get('unit', '')
+        dose_quantity_value = ((dosage_instr.get('doseAndRate') or _EMPTY_LIST)[0].get('doseQuantity') or _EMPTY).get('value', '')
+        dose_quantity_unit = ((dosage_instr.get('doseAndRate') or _EMPTY_LIST)[0].get('doseQuantity') or _EMPTY).get('unit', '')
         
         reference_result = extract_ref_display(med)        
         item = {}
@@ -455,19 +578,13 @@ def format_medication_dispenses(bundle: Dict[str, Any]) -> list:
 
     lines = []
     for entry in entries:
-        med = entry.get('resource', {})               
+        med = (entry.get('resource') or _EMPTY)               
         status = med.get('status', 'unknown')
-        medication = med.get('medicationCodeableConcept', {}).get('coding', [{}])[0].get('display', {}) or 'Unknown Medication'        
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationCodeableConcept', {}).get('coding', [{}])[0].get('code', {}) or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationReference', {}).get('display') or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationReference', {}).get('reference') or 'Unknown Medication' 
-        
-        dosage_instr = med.get('dosageInstruction', [{}])[0]
-        dosage_text =  dosage_instr.get('route', {}).get('coding', [{}])[0].get('code', '')
-        dosage_timing = dosage_instr.get('timing', {}).get('code', {}).get('coding', [{}])[0].get('code', '')
+        medication = _medication_name(med)
+        
+        dosage_instr = (med.get('dosageInstruction') or _EMPTY_LIST)[0]
+        dosage_text =  ((dosage_instr.get('route') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code', '')
+        dosage_timing = (((dosage_instr.get('timing') or _EMPTY).get('code') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code', '')
         reference_result = extract_ref_display(med)        
         item = {}
         item['medication_dispense_id'] = med.get('id')
@@ -487,29 +604,23 @@ def format_medication_administrations(bundle: Dict[str, Any]) -> list:
 
     lines = []
     for entry in entries:
-        med = entry.get('resource', {})               
+        med = (entry.get('resource') or _EMPTY)               
         status = med.get('status', 'unknown')
-        category = med.get('category', {}).get('coding', [{}])[0].get('code', {}) or 'Unknown Category'                
-        medication = med.get('medicationCodeableConcept', {}).get('coding', [{}])[0].get('display', {}) or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationCodeableConcept', {}).get('coding', [{}])[0].get('code', {}) or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationReference', {}).get('display') or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationReference', {}).get('reference') or 'Unknown Medication' 
-        
-        dosage_instr = med.get('dosage', {})
+        category = ((med.get('category') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code') or 'Unknown Category'                
+        medication = _medication_name(med)
+        
+        dosage_instr = (med.get('dosage') or _EMPTY)
         dosage_method = ''
         dosage_dose = ''
         dosage_rate = ''
         
         if dosage_instr != {}:
-            dosage_method = dosage_instr.get('method', {}).get('coding', [{}])[0].get('code', '')
-            dosage_dose = str(dosage_instr.get('dose', {}).get('value', '')) + ' ' + dosage_instr.get('dose', {}).get('unit', '')
-            dosage_rate = str(dosage_instr.get('rateQuantity', {}).get('value', '')) + ' ' + dosage_instr.get('rateQuantity', {}).get('unit', '')
+            dosage_method = ((dosage_instr.get('method') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code', '')
+            dosage_dose = str((dosage_instr.get('dose') or _EMPTY).get('value', '')) + ' ' + (dosage_instr.get('dose') or _EMPTY).get('unit', '')
+            dosage_rate = str((dosage_instr.get('rateQuantity') or _EMPTY).get('value', '')) + ' ' + (dosage_instr.get('rateQuantity') or _EMPTY).get('unit', '')
         
-        valid_start = med.get('effectivePeriod', {}).get('start', '')
-        valid_end = med.get('effectivePeriod', {}).get('end', '')
+        valid_start = (med.get('effectivePeriod') or _EMPTY).get('start', '')
+        valid_end = (med.get('effectivePeriod') or _EMPTY).get('end', '')
 
         valid_str = ''
         if valid_start != '' and valid_end != '':
@@ -535,7 +646,7 @@ def format_medication_administrations(bundle: Dict[str, Any]) -> list:
 def format_medication_info(input: Dict[str, Any]) -> str:
 
     result_value = 'Unknown Medication'
-    identifier_list = input.get('identifier', [{}])
+    identifier_list = (input.get('identifier') or _EMPTY_LIST)
     for identifier in identifier_list:
         current_system = identifier.get('system', '')
         current_value = identifier.get('value', '')
@@ -554,21 +665,15 @@ def format_medication_statement(bundle: Dict[str, Any]) -> list:
 
     lines = []
     for entry in entries:
-        med = entry.get('resource', {})               
+        med = (entry.get('resource') or _EMPTY)               
         status = med.get('status', 'unknown')
         
-        medication = med.get('medicationCodeableConcept', {}).get('coding', [{}])[0].get('display', {}) or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationCodeableConcept', {}).get('coding', [{}])[0].get('code', {}) or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationReference', {}).get('display') or 'Unknown Medication'
-        if medication == 'Unknown Medication':
-            medication = med.get('medicationReference', {}).get('reference') or 'Unknown Medication' 
+        medication = _medication_name(med)
         
-        dosage = med.get('dosage', [{}])[0].get('text', '')
+        dosage = (med.get('dosage') or _EMPTY_LIST)[0].get('text', '')
         
-        valid_start = med.get('effectivePeriod', {}).get('start', '')
-        valid_end = med.get('effectivePeriod', {}).get('end', '')
+        valid_start = (med.get('effectivePeriod') or _EMPTY).get('start', '')
+        valid_end = (med.get('effectivePeriod') or _EMPTY).get('end', '')
 
         valid_str = ''
         if valid_start != '' and valid_end != '':
@@ -595,17 +700,17 @@ def format_diagnostic_reports(bundle: Dict[str, Any]) -> list:
 
     lines = []
     for entry in entries:
-        med = entry.get('resource', {})               
+        med = (entry.get('resource') or _EMPTY)               
         status = med.get('status', '')
-        category = med.get('category', [{}])[0].get('coding', [{}])[0].get('display', '')
+        category = ((med.get('category') or _EMPTY_LIST)[0].get('coding') or _EMPTY_LIST)[0].get('display', '')
         if category == '':
-            category = med.get('category', [{}])[0].get('coding', [{}])[0].get('code', '')
+            category = ((med.get('category') or _EMPTY_LIST)[0].get('coding') or _EMPTY_LIST)[0].get('code', '')
         issued_date = med.get('issued', '')
         if issued_date != '':
             issued_date = convert_fhir_to_local_str(issued_date)                
-        code = med.get('code', {}).get('text', '')
+        code = (med.get('code') or _EMPTY).get('text', '')
         if code == '':
-            code = med.get('code', {}).get('coding', [{}])[0].get('display', '')
+            code = ((med.get('code') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('display', '')
         conclusion = med.get('conclusion', '')
         reference_result = extract_ref_display(med) 
         item = {}
@@ -627,23 +732,23 @@ def format_document_references(bundle: Dict[str, Any]) -> list:
 
     lines = []
     for entry in entries:
-        doc = entry.get('resource', {})               
+        doc = (entry.get('resource') or _EMPTY)               
         status = doc.get('status', '')
-        doc_type = doc.get('type', {}).get('coding', [{}])[0].get('display', '')   
+        doc_type = ((doc.get('type') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('display', '')   
         if doc_type == '':
-            doc_type = doc.get('type', {}).get('coding', [{}])[0].get('code', '')     
-        category = doc.get('category', [{}])[0].get('coding', [{}])[0].get('display', '')
+            doc_type = ((doc.get('type') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code', '')     
+        category = ((doc.get('category') or _EMPTY_LIST)[0].get('coding') or _EMPTY_LIST)[0].get('display', '')
         if category == '':
-            category = doc.get('category', [{}])[0].get('coding', [{}])[0].get('code', '')
+            category = ((doc.get('category') or _EMPTY_LIST)[0].get('coding') or _EMPTY_LIST)[0].get('code', '')
             
         date = doc.get('date', '')
         if date != '':
             date = convert_fhir_to_local_str(date)         
                    
         title = doc.get('description', '')        
-        author = doc.get('author', [{}])[0].get('display', '')
+        author = (doc.get('author') or _EMPTY_LIST)[0].get('display', '')
         
-        content = doc.get('content', [{}])[0].get('attachment', {})
+        content = ((doc.get('content') or _EMPTY_LIST)[0].get('attachment') or _EMPTY)
         content_title = content.get('title', '')
         content_url = content.get('url', '')
         content_type = content.get('contentType', '')
@@ -672,14 +777,14 @@ def format_allergy_intolerances(bundle: Dict[str, Any]) -> list:
 
     lines = []
     for entry in entries:
-        allergy = entry.get('resource', {})               
-        clinical_status = allergy.get('clinicalStatus', {}).get('coding', [{}])[0].get('display', '')
+        allergy = (entry.get('resource') or _EMPTY)               
+        clinical_status = ((allergy.get('clinicalStatus') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('display', '')
         if clinical_status == '':
-            clinical_status = allergy.get('clinicalStatus', {}).get('coding', [{}])[0].get('code', '')
+            clinical_status = ((allergy.get('clinicalStatus') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code', '')
         
-        verification_status = allergy.get('verificationStatus', {}).get('coding', [{}])[0].get('display', '')
+        verification_status = ((allergy.get('verificationStatus') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('display', '')
         if verification_status == '':
-            verification_status = allergy.get('verificationStatus', {}).get('coding', [{}])[0].get('code', '')
+            verification_status = ((allergy.get('verificationStatus') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code', '')
             
         allergy_type = allergy.get('type', '')
         
@@ -688,7 +793,7 @@ def format_allergy_intolerances(bundle: Dict[str, Any]) -> list:
         
         criticality = allergy.get('criticality', '')
         
-        code_list = allergy.get('code', {}).get('coding', [])
+        code_list = (allergy.get('code') or _EMPTY).get('coding', [])
         code_str = ''
         for code in code_list:
             current_code = code.get('display', '')
@@ -699,8 +804,8 @@ def format_allergy_intolerances(bundle: Dict[str, Any]) -> list:
                     code_str += ', '
                 code_str += current_code
         
-        substance = allergy.get('code', {}).get('text', '')        
-        note = allergy.get('note', [{}])[0].get('text', '')
+        substance = (allergy.get('code') or _EMPTY).get('text', '')        
+        note = (allergy.get('note') or _EMPTY_LIST)[0].get('text', '')
         
         onset_date = ''
         if allergy.get('onsetDateTime'):
@@ -736,14 +841,14 @@ def format_family_member_history(bundle: Dict[str, Any]) -> list:
 
     lines = []
     for entry in entries:
-        family_members = entry.get('resource', {})               
+        family_members = (entry.get('resource') or _EMPTY)               
         status = family_members.get('status', '')
-        relationship = family_members.get('relationship', {}).get('coding', [{}])[0].get('display', '')   
+        relationship = ((family_members.get('relationship') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('display', '')   
         if relationship == '':
-            relationship = family_members.get('relationship', {}).get('coding', [{}])[0].get('code', '')
-        sex = family_members.get('sex', {}).get('coding', [{}])[0].get('display', '')
+            relationship = ((family_members.get('relationship') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code', '')
+        sex = ((family_members.get('sex') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('display', '')
         if sex == '':
-            sex = family_members.get('sex', {}).get('coding', [{}])[0].get('code', '')
+            sex = ((family_members.get('sex') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code', '')
         name = family_members.get('name', '')
         deceased_str = 'Unknown'
         deceasedBoolean = family_members.get('deceasedBoolean', None)
@@ -755,10 +860,10 @@ def format_family_member_history(bundle: Dict[str, Any]) -> list:
         condition_list = family_members.get('condition', [])
         conditions_str = ''
         for condition in condition_list:
-            current_condition = condition.get('code', {}).get('text', '')
+            current_condition = (condition.get('code') or _EMPTY).get('text', '')
             if current_condition != '':    
                 current_condition += ', '
-            current_condition += condition.get('code', {}).get('coding', [{}])[0].get('display', '')
+            current_condition += ((condition.get('code') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('display', '')
             if conditions_str != '':
                 conditions_str += '; '
             conditions_str += current_condition
@@ -785,13 +890,13 @@ def format_immunizations(bundle: Dict[str, Any]) -> list:
 
     lines = []
     for entry in entries:
-        immunization = entry.get('resource', {})               
+        immunization = (entry.get('resource') or _EMPTY)               
         status = immunization.get('status', '')
-        vaccine_code = immunization.get('vaccineCode', {}).get('text', '')
+        vaccine_code = (immunization.get('vaccineCode') or _EMPTY).get('text', '')
         if vaccine_code == '':
-            vaccine_code = immunization.get('vaccineCode', {}).get('coding', [{}])[0].get('display', '')   
+            vaccine_code = ((immunization.get('vaccineCode') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('display', '')   
         if vaccine_code == '':
-            vaccine_code = immunization.get('vaccineCode', {}).get('coding', [{}])[0].get('code', '')
+            vaccine_code = ((immunization.get('vaccineCode') or _EMPTY).get('coding') or _EMPTY_LIST)[0].get('code', '')
         protocols = immunization.get("protocolApplied", [])
         parsed_results = []
         for protocol in protocols:
@@ -800,7 +905,7 @@ def format_immunizations(bundle: Dict[str, Any]) -> list:
             disease_names = []
             for d in target_disease_list:
                 # text 우선, 없으면 coding의 display 추출
-                name = d.get("text") or (d.get("coding", [{}])[0].get("display"))
+                name = d.get("text") or ((d.get("coding") or _EMPTY_LIST)[0].get("display"))
                 if name:
                     disease_names.append(name)
             
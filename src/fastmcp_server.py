@@ -1,5 +1,6 @@
 import asyncio
 import os
+import sys
 from dotenv import load_dotenv
 load_dotenv()
 from typing import Optional, Literal
@@ -511,13 +512,20 @@ async def get_patient_procedures(patient_id = None, procedure_id=None, encounter
 
 async def _generate_detailed_report_by_encounter(encounter_id: str, limit: int):
     report = [f"# Encounter Clinical Summary (ID: {encounter_id})"]
-        
-    results = await asyncio.gather(
+
+    coros = (
         fhir_client.get_patient_observations({"encounter_id": encounter_id, "category": "vital-signs"}),
         fhir_client.get_patient_conditions({"encounter_id": encounter_id}),
         fhir_client.get_patient_procedures({"encounter_id": encounter_id}),
         fhir_client.get_patient_medication_requests({"encounter_id": encounter_id}),
     )
+    if sys.version_info >= (3, 11):
+        # TaskGroup: 하나가 실패하면 형제 태스크를 즉시 취소 (gather보다 빠른 실패 반환)
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(coro) for coro in coros]
+        results = [task.result() for task in tasks]
+    else:
+        results = await asyncio.gather(*coros)
     
     report.append("## Observation: vital signs (검사 내역)")
     report.append(str(results[0]))